@@ -1,20 +1,141 @@
+import argparse
 import sys
-from tkinter import Tk, messagebox
-from tkinter.filedialog import askdirectory
-import os
+import time
 from pathlib import Path
-from audit_inspector.common import functions, settings
-from audit_inspector.controls import connection, authorization, firewall, logging, patching
-from jinja2 import Environment, PackageLoader, FileSystemLoader
-from audit_inspector import controls
+from audit_inspector.common import cache, ciphers, dispatch, evidence, profiling
+from audit_inspector.common.results import ResultSet
+# Platform, control and report modules are imported when they are first needed, so startup only loads what a run uses
 
 
-def main():
-    results = [] # Holds control function returns from mulitple files.
-    #template_name = ''
-    evidence_dir = set_evidence_dir()
-    for text in read_files(evidence_dir):
-        results.extend(call_control_function(text))
+def main(argv=None):
+    args = parse_arguments(argv)
+    evidence_dirs = [Path(evidence_dir) for evidence_dir in args.evidence_dirs] or [set_evidence_dir()]
+    worker_options = (args.cache_dir, args.cache_size * 1024 * 1024, bool(args.profile), args.cipher_catalog, args.cipher_profile)
+    initialize_worker(*worker_options)
+    executor = None
+    if args.jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=args.jobs, initializer=initialize_worker, initargs=worker_options)
+    try:
+        if args.collect:
+            from audit_inspector.common import collector
+            results = ResultSet(dispatch.get_registry().finalizer)
+            _, collected = collector.run(args.collect, args.collect_dir, process_file, args.concurrency)
+            for test_results in collected:
+                results.extend(test_results)
+            results.finalize()
+            write_reports(args, results)
+            return results
+        if args.watch:
+            from audit_inspector.common import watch
+            watcher = watch.EvidenceWatcher(evidence_dirs, list_evidence_paths, lambda files: list(process_files(files, args, executor)))
+            return watch.run(watcher, args.interval, args.results_file, args.serve, on_update=lambda results: write_reports(args, results))
+        results = ResultSet(dispatch.get_registry().finalizer) # Holds control function returns from mulitple files, one columnar store per control.
+        evidence_files = [path for evidence_dir in evidence_dirs for path in list_evidence_files(evidence_dir)]
+        started = time.perf_counter()
+        for test_results in process_files(evidence_files, args, executor):
+            results.extend(test_results)
+        with profiling.stage('finalize'):
+            results.finalize() # Merge records across files and run the checks that need them
+        if args.profile:
+            write_profile(args, time.perf_counter() - started, evidence_files)
+        write_reports(args, results)
+        return results
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def process_files(evidence_files, args, executor=None):
+    """
+    Process evidence files, in worker processes when there is an executor.
+
+    Returns:
+    The control function returns of each file, in the order of evidence_files.
+    """
+    work = profile_file if args.profile else process_file
+    if executor is None:
+        for input_file in evidence_files:
+            yield collect_results(work(input_file))
+        return
+    # Workers are handed file paths and archive member names and read the evidence themselves so the text is never
+    # pickled. map() returns
+    # results in submission order, so the merged results are in the same order as a serial run.
+    chunksize = max(1, len(evidence_files) // (args.jobs * 4))
+    for test_results in executor.map(work, evidence_files, chunksize=chunksize):
+        yield collect_results(test_results)
+
+
+def write_reports(args, results):
+    """
+    Write the SQLite database, Excel and HTML or text reports asked for on the command line.
+    """
+    if args.sqlite:
+        results.to_sqlite(args.sqlite)
+    if args.output:
+        from audit_inspector.common import excel
+        excel.write_workbook(results, args.output)
+    if args.report:
+        from audit_inspector.common import report
+        report.write_report(results, args.report, Path(args.cache_dir) / 'templates' if args.cache_dir else None)
+
+
+def parse_arguments(argv=None):
+    """
+    Parse command line options.
+
+    Parameters:
+    argv: List of arguments, defaults to sys.argv.
+
+    Returns:
+    Namespace with evidence_dirs, jobs, cache_dir, cache_size, sqlite, output, profile, profile_top, profile_mode,
+    watch, interval, results_file, serve, collect, collect_dir and concurrency.
+    """
+    parser = argparse.ArgumentParser(prog='audit_inspector', description='Analyze system generated evidence for compliance.')
+    parser.add_argument('evidence_dirs', nargs='*', metavar='evidence_dir', help='Directories containing the evidence files. Without one the directory is picked in a dialog when running from an exe, or ./test_data/ otherwise.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes used to process evidence files.')
+    parser.add_argument('--cache-dir', help='Directory used to cache parsed evidence between runs.')
+    parser.add_argument('--cache-size', type=int, default=512, help='Maximum size of the parse cache in MB.')
+    parser.add_argument('--cipher-profile', help="Cipher policy profile the connection checks use, e.g. 'pci-minimum' (the default) or 'modern'.")
+    parser.add_argument('--cipher-catalog', metavar='FILE', help='Cipher policy catalog to read the profile from instead of the bundled policies/ciphers.json.')
+    parser.add_argument('-o', '--output', help='Write an Excel report to this .xlsx file.')
+    parser.add_argument('--report', metavar='FILE', help='Write an HTML report to this file, or a text report when it ends in .txt.')
+    parser.add_argument('--sqlite', help='Write the results to this SQLite database, one table per control.')
+    parser.add_argument('--profile', metavar='FILE', help='Write the time, calls and allocated bytes of each stage and evidence file to this JSON file.')
+    parser.add_argument('--profile-top', type=int, default=0, metavar='N', help='Profile the N slowest files again in detail, see --profile-mode.')
+    parser.add_argument('--profile-mode', choices=['cprofile', 'tracemalloc'], default='cprofile', help='Detail captured for the slowest files: cProfile statistics or tracemalloc allocation sites.')
+    parser.add_argument('--watch', action='store_true', help='Keep running and process evidence files again as they are added, modified or deleted.')
+    parser.add_argument('--interval', type=float, default=5, help='Seconds between checks for changed evidence in watch mode.')
+    parser.add_argument('--results-file', help='Watch mode: keep the results in this JSON file.')
+    parser.add_argument('--serve', metavar='[HOST:]PORT', help='Watch mode: serve the results as JSON over HTTP, at /results and /results/<control>.')
+    parser.add_argument('--collect', metavar='MANIFEST', help='Collect the evidence by running the commands in this JSON manifest instead of reading evidence directories.')
+    parser.add_argument('--collect-dir', default='collected', help='Directory the collected evidence is saved to.')
+    parser.add_argument('--concurrency', type=int, help='Commands run at once while collecting, overrides the manifest.')
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.profile_top and not args.profile:
+        parser.error('--profile-top requires --profile')
+    if (args.results_file or args.serve) and not args.watch:
+        parser.error('--results-file and --serve require --watch')
+    if args.collect and (args.evidence_dirs or args.watch):
+        parser.error('--collect can not be used with evidence directories or --watch')
+    if args.watch and args.profile:
+        parser.error('--profile can not be used with --watch')
+    if args.profile:
+        try: # Fail now rather than lose the profile once every file has been processed
+            Path(args.profile).resolve().parent.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            parser.error(f'Unable to create the directory of --profile {args.profile}: {e}')
+        if Path(args.profile).is_dir():
+            parser.error(f'--profile {args.profile} is a directory, give the path of the JSON file to write')
+    if args.cipher_catalog or args.cipher_profile:
+        try: # Report a missing catalog or profile now rather than after every file has been processed
+            ciphers.configure(args.cipher_catalog, args.cipher_profile)
+            ciphers.get_policy()
+        except ciphers.PolicyError as e:
+            parser.error(str(e))
+    return args
 
 
 def set_evidence_dir():
@@ -29,6 +150,8 @@ def set_evidence_dir():
     """
     evidence_dir = ''
     if getattr(sys, 'frozen', False): # Program is running from an exe
+        from tkinter import Tk # Only the exe needs a GUI, command line runs never import tkinter
+        from tkinter.filedialog import askdirectory
         Tk().withdraw() # We don't need a full GUI, so keep the root window from appearing    
         evidence_dir = Path(askdirectory()) # Open a file-browser to let user select the evidence folder
     else: # Program is being called directly, outside of an exe
@@ -37,22 +160,129 @@ def set_evidence_dir():
     return evidence_dir
 
 
-def read_files(evidence_dir):
+def list_evidence_files(evidence_dir):
+    """
+    List the evidence in a given directory: .txt files and the text members of .zip, .tar, .tar.gz and .txt.gz files.
+
+    Parameters:
+    evidence_dir (Path): Directory to read files from
+
+    Returns:
+    List of file paths and evidence.Evidence archive members, sorted by file so results are always merged in the same
+    order. A .tar.gz is listed whole since its members can only be read in order, process_file() reads them all. An
+    archive that can't be listed is reported and skipped.
+    """
+    sources = []
+    for path in list_evidence_paths(evidence_dir):
+        try:
+            sources.extend(evidence.list_archive(path))
+        except evidence.archive_errors as e: # One corrupt archive is skipped rather than stopping the run
+            print(f'Error listing {path}: {e!r}', file=sys.stderr)
+    return sources
+
+
+def list_evidence_paths(evidence_dir):
+    """
+    Returns:
+    Sorted list of the paths of the evidence files and archives in a directory, without opening them.
+    """
+    suffixes = (evidence.evidence_suffix,) + evidence.archive_suffixes
+    return sorted(path for path in evidence_dir.iterdir() if path.name.lower().endswith(suffixes) and path.is_file())
+
+
+def read_file(input_file):
     """
-    Read each file in a given directory.
+    Read a single evidence file.
 
     Parameters:
-    evidence_dir (str): Directory to read files from
+    input_file (Path or evidence.Evidence): File or archive member to read
 
     Returns:
     text: Text inside the file with decorators for easily separating by sections.
     """
-    for input_file in evidence_dir.glob('*.txt'): # Read each file in the evidence directory
-        with open(input_file, 'r', encoding='utf8') as f:
-            text = '+ ' + f.read() + '\n+ ' # plus sign is used as a section separator so put one at the end
-            # TODO write a function to clean up the text file and make sure it is parsable
-            yield text
-        
+    try:
+        content = ''.join(evidence.iter_text_chunks(input_file)).replace('\r\n', '\n')
+    finally:
+        if isinstance(input_file, evidence.Evidence):
+            input_file.close()
+    text = '+ ' + content + '\n+ ' # plus sign is used as a section separator so put one at the end
+    # TODO write a function to clean up the text file and make sure it is parsable
+    return text
+
+
+def process_file(input_file):
+    """
+    Run the matching controls against one evidence file.
+
+    This is the unit of work handed to the worker processes. Any error is reported and contained to the file that
+    caused it so one bad file doesn't stop the rest of the run.
+
+    Parameters:
+    input_file (Path or evidence.Evidence): File, archive member or .tar.gz archive to process
+
+    Returns:
+    List of control function returns for the file, empty if the file could not be processed.
+    """
+    test_results = []
+    for source in evidence.iter_evidence(input_file): # Every member of a .tar.gz, otherwise just the file
+        try:
+            test_results.extend(call_control_function(source)) # The evidence is streamed from the file rather than read whole
+        except Exception as e:
+            print(f'Error processing {source}: {e!r}', file=sys.stderr)
+    return test_results
+
+
+def initialize_worker(cache_dir, cache_bytes, profile, cipher_catalog=None, cipher_profile=None):
+    """
+    Set up a process to handle evidence files. Runs in the main process and as the initializer of each worker.
+    """
+    cache.configure(cache_dir, cache_bytes)
+    ciphers.configure(cipher_catalog, cipher_profile)
+    if profile:
+        profiling.enable()
+
+
+def profile_file(input_file):
+    """
+    process_file() with the file's stage statistics.
+
+    Returns:
+    Tuple of the control function returns and the statistics collected while processing the file, so workers can
+    send their statistics back with their results.
+    """
+    with profiling.profiler.file(input_file):
+        test_results = process_file(input_file)
+    return test_results, profiling.collect()
+
+
+def collect_results(returned):
+    """
+    Returns:
+    The control function returns from process_file() or profile_file(), merging any statistics into the profile.
+    """
+    if isinstance(returned, tuple):
+        test_results, stats = returned
+        profiling.profiler.merge(stats)
+        return test_results
+    return returned
+
+
+def write_profile(args, seconds, evidence_files):
+    """
+    Write the --profile report, capturing a cProfile or tracemalloc profile of the slowest files first.
+    """
+    run_profiler = profiling.profiler
+    profiling.disable() # The captures below must not add to the statistics
+    captures = []
+    if args.profile_top:
+        cache.configure(None) # Parse the files again rather than loading them from the cache
+        output_dir = Path(args.profile).parent
+        sources = {str(source): source for source in evidence_files} # The profile names files by their str()
+        for input_file in run_profiler.slowest(args.profile_top):
+            captures.append(profiling.capture(process_file, sources[input_file], args.profile_mode, output_dir))
+            cache.forget()
+    profiling.write_report(args.profile, run_profiler, seconds, captures)
+
         
 def call_control_function(text):
     """
@@ -60,30 +290,19 @@ def call_control_function(text):
 
     Use expected keywords in system commands to determine what category of evidence this is (firewall rules,
     authentication, etc.) and what platform generated it (AWS, Linux, etc.). This is used to call the appropriate
-    function and class methods.
+    function and class methods. The keywords come from settings.control_categories plus anything registered through
+    dispatch.register(), and all of them are searched for in a single pass over the evidence.
 
     Parameters:
-    text: Text from files read by the read_files function.
+    text: Text from files read by the read_file function, or the path to an evidence file.
 
     Returns:
-    None
+    List of the control function returns.
     """
-    test_results = []
-    for platform, control in settings.control_categories.items():
-        for key in control:
-            """
-            TODO find a clean way to check if every item from a list is in the text. This will let me build better settings search words.
-            something like:
-            if (isinstance(control[key], list)):
-                for item in control[key]:
-                    if str(item) in text:
-            """
-            if str(control[key]) in text:
-                template_name = key
-                if eval(f'controls.{key}.{platform}(text)'):
-                    eval(f'test_results.append(controls.{key}.{platform}(text))') # Call controls function and aggregate the results from all files.
-    return test_results
+    return dispatch.get_registry().dispatch(text)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    from multiprocessing import freeze_support
+    freeze_support() # Needed for the worker processes when running from a PyInstaller exe
+    main()
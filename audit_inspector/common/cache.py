@@ -0,0 +1,180 @@
+import hashlib
+import os
+import pickle
+import zlib
+from pathlib import Path
+from audit_inspector.common import evidence, profiling
+
+block_size = 1024 * 1024 # Bytes read at a time when hashing an evidence file
+default_max_bytes = 512 * 1024 * 1024
+
+
+class ParseCache():
+    """
+    On-disk cache of parsed platform objects.
+
+    Entries are keyed by the hash of the evidence content and the parser class and version, so an unchanged file is
+    never parsed twice and bumping a parser's version invalidates everything it produced. Each entry is one field of
+    a platform object pickled and zlib compressed, so a run only loads the fields it uses. When the cache grows past
+    max_bytes the least recently used entries are removed.
+
+    Only point this at a directory you trust, entries are unpickled when they are loaded.
+    """
+
+    def __init__(self, directory, max_bytes=default_max_bytes):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.size = sum(entry.stat().st_size for entry in self.directory.glob('*.bin'))
+
+    def path(self, cls, digest, field):
+        return self.directory / f'{cls.__module__}.{cls.__name__}-v{cls.parser_version}-{digest}-{field}.bin'
+
+    def load(self, cls, digest, field):
+        """
+        Returns:
+        The cached value of the field, or missing if this evidence hasn't been cached.
+        """
+        path = self.path(cls, digest, field)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.loads(zlib.decompress(f.read()))
+            os.utime(path) # Mark as recently used for eviction
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError):
+            return missing
+        return value
+
+    def store(self, cls, digest, field, value):
+        path = self.path(cls, digest, field)
+        data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        temp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path) # Atomic so other processes never read a partial entry
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        for entry in self.directory.glob('*.bin'):
+            try:
+                entries.append((entry.stat().st_mtime, entry.stat().st_size, entry))
+            except OSError: # Removed by another process
+                continue
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                entry.unlink()
+            except OSError:
+                pass
+            self.size -= size
+
+
+class cached_field():
+    """
+    Decorator for a platform class attribute that is parsed on first access and then memoized.
+
+    When the parse cache is on, the value is loaded from the cache if this evidence was parsed before and stored in
+    it otherwise. Like functools.cached_property the value is kept in the instance dictionary after the first access.
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.name = function.__name__
+        self.__doc__ = function.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        digest = instance.__dict__.get('digest')
+        value = missing
+        if cache is not None and digest:
+            with profiling.stage('cache:load'):
+                value = cache.load(owner, digest, self.name)
+        if value is missing:
+            with profiling.stage(f'parse:{owner.__name__}.{self.name}'):
+                value = self.function(instance)
+            if cache is not None and digest:
+                cache.store(owner, digest, self.name, value)
+        instance.__dict__[self.name] = value
+        return value
+
+
+missing = object()
+cache = None
+recent = None # Most recently parsed (class, source, object), reused by every control run on the same evidence
+
+
+def configure(directory, max_bytes=default_max_bytes):
+    """
+    Turn on the parse cache for this process. Without it parse() always parses the evidence.
+
+    Parameters:
+    directory: Directory that holds the cache entries, created if needed.
+    max_bytes: Size the cache is trimmed to.
+    """
+    global cache
+    cache = ParseCache(directory, max_bytes) if directory else None
+
+
+def content_digest(source):
+    """
+    Hash evidence content.
+
+    Parameters:
+    source: Evidence text (str), path to an evidence file or evidence.Evidence.
+
+    Returns:
+    Hex SHA-256 digest of the content.
+    """
+    digest = hashlib.sha256()
+    if isinstance(source, str):
+        digest.update(source.encode('utf8'))
+    else:
+        with evidence.open_evidence(source) as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def parse(cls, source):
+    """
+    Build a platform object for some evidence.
+
+    Platform objects parse their fields lazily through cached_field, this only records the content hash used to find
+    them in the cache. The object is reused when several controls are run against the same evidence until forget()
+    is called.
+
+    Parameters:
+    cls: Platform class with a parser_version attribute, e.g. platforms.kubernetes.kubernetes.
+    source: Evidence text (str), path to an evidence file or evidence.Evidence.
+
+    Returns:
+    Instance of cls.
+    """
+    global recent
+    if recent and recent[0] is cls and (recent[1] is source or (not isinstance(source, str) and recent[1] == source)):
+        return recent[2]
+    platform_object = cls(source)
+    if cache is not None:
+        platform_object.digest = content_digest(source)
+    recent = (cls, source, platform_object)
+    return platform_object
+
+
+def forget():
+    """
+    Drop the platform object kept by parse(). Called once all controls have run against a piece of evidence.
+    """
+    global recent
+    recent = None
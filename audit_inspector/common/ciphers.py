@@ -0,0 +1,232 @@
+"""
+Cipher policy catalog.
+
+The catalog is a JSON file, policies/ciphers.json by default, holding profiles such as 'pci-minimum' and 'modern'.
+A profile lists the weak algorithms of each category with the reason each one is weak:
+
+ssh-ciphers, ssh-macs, ssh-kex     Names from 'sshd -T' and 'ssh -v', e.g. 'arcfour256', 'hmac-md5'
+tls-versions                       Protocol names from openssl s_client, e.g. 'TLSv1'
+tls-suites                         OpenSSL or IANA cipher suite names, e.g. 'ECDHE-RSA-RC4-SHA'
+
+Each category may have 'names', matched exactly, 'prefixes', matched against the start of a name, and 'parts',
+matched against the components of a name split on '-', '_', '@' and '.', e.g. 'cbc' in 'aes128-cbc'. Matching ignores
+case. A profile may name another in 'extends' to add to its lists.
+
+A profile is compiled once into a set and a prefix trie per category. The verdict of each distinct name is then kept,
+so classifying thousands of hosts that offer the same few dozen algorithms costs a dictionary lookup per item.
+"""
+import json
+import re
+from collections import namedtuple
+from pathlib import Path
+from audit_inspector.common import settings
+
+default_catalog = Path(__file__).resolve().parent.parent / 'policies' / 'ciphers.json'
+categories = ('ssh-ciphers', 'ssh-macs', 'ssh-kex', 'tls-versions', 'tls-suites')
+name_parts = re.compile(r'[-_@.]')
+
+# A weak item found in a record: its category, the name as it appeared in the evidence and why it is weak
+Weakness = namedtuple('Weakness', ['category', 'name', 'reason'])
+
+
+class PolicyError(Exception):
+    pass
+
+
+class PrefixTrie():
+    """
+    Map name prefixes to values, finding the longest prefix of a name in one walk over its characters.
+    """
+
+    end = '' # Key of the value stored at a node, no character is the empty string
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, prefix, value):
+        node = self.root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[self.end] = value
+
+    def longest(self, name):
+        """
+        Returns:
+        The value of the longest prefix of name in the trie, or None.
+        """
+        node = self.root
+        found = node.get(self.end)
+        for char in name:
+            node = node.get(char)
+            if node is None:
+                break
+            found = node.get(self.end, found)
+        return found
+
+
+class CategoryMatcher():
+    """
+    The compiled rules of one category of a profile.
+    """
+
+    def __init__(self, rules):
+        self.names = {name.lower(): reason for name, reason in rules.get('names', {}).items()}
+        self.parts = {part.lower(): reason for part, reason in rules.get('parts', {}).items()}
+        self.prefixes = PrefixTrie()
+        for prefix, reason in rules.get('prefixes', {}).items():
+            self.prefixes.add(prefix.lower(), reason)
+
+    def match(self, name):
+        """
+        Returns:
+        Why the name is weak, or None if it isn't.
+        """
+        name = name.lower()
+        reason = self.names.get(name) or self.prefixes.longest(name)
+        if reason is None and self.parts:
+            reason = next((self.parts[part] for part in name_parts.split(name) if part in self.parts), None)
+        return reason
+
+
+class CipherPolicy():
+    """
+    A compiled profile of the catalog.
+
+    Parameters:
+    name: Profile name.
+    profile: The profile's rules, with those of the profiles it extends already added.
+    titles: {<category>: {'title':, 'remediation':}} from the catalog.
+    """
+
+    def __init__(self, name, profile, titles):
+        self.name = name
+        self.description = profile.get('description', '')
+        self.titles = titles
+        self.matchers = {category: CategoryMatcher(profile.get(category, {})) for category in categories}
+        self.verdicts = {} # (category, name) -> reason or None, shared by every record classified
+
+    def match(self, category, name):
+        key = (category, name)
+        if key not in self.verdicts:
+            self.verdicts[key] = self.matchers[category].match(name)
+        return self.verdicts[key]
+
+    def items(self, data):
+        """
+        Yield the (category, name) pairs of a connection record that the policy applies to: the negotiated and
+        available SSH ciphers, its MACs and key exchange algorithms, and the version and suite of every TLS
+        protocol:cipher pair.
+        """
+        protocol = data.get('Protocol', '').lower()
+        if protocol == 'ssh':
+            if data.get('Cipher'):
+                yield 'ssh-ciphers', data['Cipher']
+            for name in data.get('Available Ciphers') or []:
+                yield 'ssh-ciphers', name
+            for name in data.get('MACs') or []:
+                yield 'ssh-macs', name
+            for name in data.get('Key Exchange') or []:
+                yield 'ssh-kex', name
+        elif protocol == 'tls':
+            # Available ciphers are <PROTOCOL VERSION>:<CIPHER> pairs, the negotiated one is among them
+            for pair in data.get('Available Ciphers') or []:
+                version, _, suite = pair.partition(':')
+                yield 'tls-versions', version
+                if suite:
+                    yield 'tls-suites', suite
+
+    def classify(self, data):
+        """
+        Returns:
+        List of every weak item of a connection record as Weaknesses, each name once per category in the order
+        they appear in the record.
+        """
+        weak = {}
+        for category, name in self.items(data):
+            if (category, name) not in weak:
+                reason = self.match(category, name)
+                if reason is not None:
+                    weak[(category, name)] = Weakness(category, name, reason)
+        return list(weak.values())
+
+    def classify_batch(self, records):
+        """
+        Classify many connection records in one pass.
+
+        Returns:
+        List with the Weaknesses of each record, in the same order as records.
+        """
+        return [self.classify(data) for data in records]
+
+
+def load_catalog(path=None):
+    """
+    Read a catalog file, the bundled one when path is None.
+
+    Returns:
+    The catalog dictionary.
+    """
+    path = Path(path) if path else default_catalog
+    try:
+        with open(path, encoding='utf8') as f:
+            catalog = json.load(f)
+    except (OSError, ValueError) as e:
+        raise PolicyError(f'Unable to read the cipher policy catalog {path}: {e}') from None
+    if not isinstance(catalog.get('profiles'), dict):
+        raise PolicyError(f'The cipher policy catalog {path} has no profiles')
+    return catalog
+
+
+def resolve_profile(catalog, name, seen=()):
+    """
+    Returns:
+    The rules of a profile, with the rules of the profiles it extends added to them.
+    """
+    profiles = catalog['profiles']
+    if name not in profiles:
+        raise PolicyError(f"Unknown cipher policy profile {name!r}, the catalog has {', '.join(profiles)}")
+    if name in seen:
+        raise PolicyError(f"Cipher policy profile {name!r} extends itself")
+    profile = profiles[name]
+    resolved = resolve_profile(catalog, profile['extends'], seen + (name,)) if profile.get('extends') else {}
+    for category in categories:
+        rules = {kind: dict(entries) for kind, entries in resolved.get(category, {}).items()}
+        for kind, entries in profile.get(category, {}).items():
+            rules.setdefault(kind, {}).update(entries)
+        resolved[category] = rules
+    resolved['description'] = profile.get('description', '')
+    return resolved
+
+
+def compile_policy(catalog, name):
+    """
+    Returns:
+    CipherPolicy for a profile of a catalog.
+    """
+    return CipherPolicy(name, resolve_profile(catalog, name), catalog.get('categories', {}))
+
+
+catalog_path = settings.cipher_catalog
+profile_name = settings.cipher_profile
+policy = None
+
+
+def configure(path=None, profile=None):
+    """
+    Choose the catalog and profile used by get_policy(). None keeps the setting from settings.py.
+    """
+    global catalog_path, profile_name, policy
+    catalog_path = path or settings.cipher_catalog
+    profile_name = profile or settings.cipher_profile
+    policy = None
+
+
+def get_policy():
+    """
+    Returns:
+    The configured CipherPolicy, compiled on first use.
+    """
+    global policy
+    if policy is None:
+        policy = compile_policy(load_catalog(catalog_path), profile_name)
+    return policy
@@ -0,0 +1,239 @@
+"""
+Collect evidence by running the audit commands against many targets concurrently.
+
+A manifest lists the targets and the commands to run for each platform. Commands are shell command lines formatted
+with the target's variables, e.g. 'ssh {host} sshd -T'. Every command of every target runs as an asyncio subprocess,
+at most 'concurrency' at a time. Each command's stdout is written to a part file as it is produced, so no output is
+held in memory, and once all of a target's commands have finished the parts are joined in manifest order into
+<target>.txt, in the same '+ <label>' format as hand collected evidence. The parsers recognize sections by their label, so it names
+the audited command rather than how it was run: a command's label is its 'label' in the manifest, or otherwise the
+command before the variables are filled in, so a host name such as 'update01' can't be mistaken for the 'date'
+command. The evidence file goes straight to the control functions and is kept for the audit trail, together with a
+collection.json log of every command's exit status, duration and stderr.
+
+Manifest:
+{
+    "concurrency": 16,          # Commands running at once, default 8
+    "timeout": 120,             # Seconds a command may run, default 300
+    "path": ["./stubs"],        # Directories put in front of PATH, relative to the manifest, e.g. stub executables
+    "commands": {
+        "linux": [
+            {"label": "hostname", "command": "ssh {host} hostname"},
+            {"label": "date", "command": "ssh {host} date"},
+            {"label": "sshd -T", "command": "ssh {host} sudo sshd -T"},
+            {"label": "ssh -v", "command": "ssh -v {host} exit 2>&1"}
+        ],
+        "kubernetes": ["kubectl --context {context} get pods -A -o json", ...]
+    },
+    "targets": [
+        {"name": "web01", "platform": "linux", "vars": {"host": "web01.example.com"}},
+        {"name": "prod", "platform": "kubernetes", "vars": {"context": "prod"}}
+    ]
+}
+"""
+import asyncio
+import json
+import os
+import shutil
+import signal
+import sys
+import time
+from pathlib import Path
+
+default_concurrency = 8
+default_timeout = 300
+read_size = 64 * 1024
+stderr_limit = 4096 # Bytes of each command's stderr kept in the collection log
+kill_grace = 5 # Seconds to wait for the output pipes to close once a timed out command is killed
+
+
+class CollectionError(Exception):
+    pass
+
+
+def load_manifest(path):
+    """
+    Read and validate a manifest.
+
+    Returns:
+    The manifest dictionary, with 'path' entries made absolute.
+    """
+    path = Path(path)
+    with open(path, encoding='utf8') as f:
+        manifest = json.load(f)
+    commands = manifest.get('commands', {})
+    for platform, platform_commands in commands.items():
+        for command in platform_commands:
+            if not isinstance(command, str) and not (isinstance(command, dict) and isinstance(command.get('command'), str)):
+                raise CollectionError(f'Manifest command of {platform} is not a command line or {{"label":, "command":}}: {command!r}')
+    names = set()
+    for target in manifest.get('targets', []):
+        if 'name' not in target or 'platform' not in target:
+            raise CollectionError(f'Manifest target without a name or platform: {target!r}')
+        if target['platform'] not in commands:
+            raise CollectionError(f"No commands for platform {target['platform']!r} of target {target['name']!r}")
+        if target['name'] in names or Path(target['name']).name != target['name']:
+            raise CollectionError(f"Target names must be unique file names: {target['name']!r}")
+        names.add(target['name'])
+    manifest['path'] = [str((path.parent / directory).resolve()) for directory in manifest.get('path', [])]
+    return manifest
+
+
+def target_commands(manifest, target):
+    """
+    Returns:
+    List of the (label, command line) of each command of a target, formatted with its variables.
+    """
+    variables = dict(target.get('vars', {}), name=target['name'])
+    commands = []
+    try:
+        for command in manifest['commands'][target['platform']]:
+            if isinstance(command, str):
+                command = {'command': command}
+            commands.append((command.get('label') or command['command'], command['command'].format(**variables)))
+        return commands
+    except KeyError as e:
+        raise CollectionError(f"Target {target['name']!r} has no variable {e.args[0]!r}") from None
+
+
+async def run_command(label, command, output_path, semaphore, timeout, environment):
+    """
+    Run one command, writing its stdout to output_path as it is produced.
+
+    The command runs in a new session, so on timeout the shell and everything it started, such as ssh, are killed as
+    one process group. The commands run through a shell, and killing only the shell would leave its children holding
+    the output pipes open until they finish.
+
+    Returns:
+    Dictionary with the label, command, the path of its stdout, stderr text, exit status and duration. The status is
+    None when the command timed out.
+    """
+    async with semaphore:
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_shell(command, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=environment, start_new_session=(os.name == 'posix'))
+
+        async def finish(output):
+            while True:
+                chunk = await process.stdout.read(read_size)
+                if not chunk:
+                    break
+                output.write(chunk)
+            return await process.wait()
+
+        stderr_task = asyncio.ensure_future(process.stderr.read())
+        with open(output_path, 'wb') as output:
+            try:
+                status = await asyncio.wait_for(finish(output), timeout)
+            except asyncio.TimeoutError:
+                kill(process)
+                await process.wait()
+                status = None
+        try:
+            stderr = await asyncio.wait_for(stderr_task, kill_grace)
+        except asyncio.TimeoutError: # A process that left the group still holds the pipe
+            stderr = b''
+        return {
+            'label': label,
+            'command': command,
+            'output': output_path,
+            'stderr': stderr[:stderr_limit].decode('utf8', errors='replace'),
+            'status': status,
+            'seconds': time.perf_counter() - started,
+        }
+
+
+def kill(process):
+    """
+    Kill a command's process group, or just the process where there are no process groups.
+    """
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError: # Exited in the meantime
+        pass
+
+
+def write_evidence(path, runs):
+    """
+    Join the stdout of a target's commands into its evidence file, one '+ <label>' section per command in manifest
+    order, and delete the part files.
+    """
+    temporary = path.with_suffix('.tmp')
+    with open(temporary, 'wb') as f:
+        for run in runs:
+            f.write(f"+ {run['label']}\n".encode('utf8'))
+            with open(run['output'], 'rb') as output:
+                shutil.copyfileobj(output, f, read_size)
+                size = output.tell()
+                if size:
+                    output.seek(size - 1)
+                    if output.read(1) != b'\n': # The next label must start a line
+                        f.write(b'\n')
+    os.replace(temporary, path)
+    for run in runs:
+        os.remove(run['output'])
+
+
+async def collect_target(manifest, target, semaphore, environment, output_dir):
+    commands = target_commands(manifest, target)
+    timeout = manifest.get('timeout', default_timeout)
+    parts = [output_dir / f".{target['name']}.{i}.part" for i in range(len(commands))]
+    runs = await asyncio.gather(*(run_command(label, command, part, semaphore, timeout, environment) for (label, command), part in zip(commands, parts)))
+    return target, runs
+
+
+async def collect(manifest, output_dir, process=None):
+    """
+    Run the manifest and hand each target's evidence to process as soon as the target is complete.
+
+    Parameters:
+    manifest: Manifest from load_manifest().
+    output_dir: Directory the raw evidence and collection.json are written to.
+    process: Callable taking the path of a target's evidence file. It is run in a worker thread, one target at a time.
+
+    Returns:
+    Tuple of the collection log, one entry per target with its commands' status, duration and stderr, and the list of
+    what process returned for each target. Both are in manifest order.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    environment = dict(os.environ)
+    if manifest.get('path'):
+        environment['PATH'] = os.pathsep.join(manifest['path'] + [environment.get('PATH', '')])
+    semaphore = asyncio.Semaphore(manifest.get('concurrency', default_concurrency))
+    tasks = [asyncio.ensure_future(collect_target(manifest, target, semaphore, environment, output_dir)) for target in manifest.get('targets', [])]
+    log = {}
+    processed = {}
+    for finished in asyncio.as_completed(tasks):
+        target, runs = await finished
+        evidence_path = output_dir / f"{target['name']}.txt"
+        write_evidence(evidence_path, runs)
+        log[target['name']] = {
+            'platform': target['platform'],
+            'evidence': str(evidence_path),
+            'commands': [{key: run[key] for key in ('label', 'command', 'status', 'seconds', 'stderr')} for run in runs],
+        }
+        failed = [run['command'] for run in runs if run['status'] != 0]
+        if failed:
+            print(f"{target['name']}: {len(failed)} command(s) failed or timed out: {', '.join(failed)}", file=sys.stderr)
+        if process is not None:
+            processed[target['name']] = await asyncio.to_thread(process, evidence_path) # Parsing is CPU bound, keep the subprocess pipes flowing meanwhile
+    ordered = {target['name']: log[target['name']] for target in manifest.get('targets', [])}
+    with open(output_dir / 'collection.json', 'w', encoding='utf8') as f:
+        json.dump(ordered, f, indent=4)
+    return ordered, [processed.get(name) for name in ordered]
+
+
+def run(manifest_path, output_dir, process=None, concurrency=None):
+    """
+    Load a manifest and collect it.
+
+    Parameters:
+    concurrency: Overrides the manifest's concurrency.
+    """
+    manifest = load_manifest(manifest_path)
+    if concurrency:
+        manifest['concurrency'] = concurrency
+    return asyncio.run(collect(manifest, output_dir, process))
@@ -0,0 +1,252 @@
+import importlib
+import re
+import sys
+from audit_inspector.common import cache, evidence, profiling, settings
+
+chunk_size = 1024 * 1024 # Characters read at a time when scanning an evidence file
+
+
+class PatternMatcher():
+    """
+    Find which of a fixed set of literal patterns occur in some text.
+
+    All of the patterns are compiled once into a single alternation so the text is scanned a single time by the regex
+    engine, which skips ahead to positions where a pattern could start. Every pattern beginning at a candidate
+    position is then verified, so overlapping patterns and patterns that are prefixes of each other are all found.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(dict.fromkeys(patterns)) # Drop duplicates but keep the order
+        self.longest = max((len(pattern) for pattern in self.patterns), default=0)
+        self.by_first_char = {}
+        for pattern in self.patterns:
+            if pattern:
+                self.by_first_char.setdefault(pattern[0], []).append(pattern)
+        if self.by_first_char:
+            alternation = '|'.join(re.escape(p) for p in sorted(self.patterns, key=len, reverse=True) if p)
+            self.candidates = re.compile(f'(?=(?:{alternation}))')
+        else:
+            self.candidates = None
+
+    def search(self, chunks):
+        """
+        Scan text for the patterns.
+
+        Parameters:
+        chunks: Iterable of strings that together make up the text. Matches spanning two chunks are found.
+
+        Returns:
+        Set of the patterns found in the text.
+        """
+        found = {pattern for pattern in self.patterns if not pattern} # An empty pattern always matches
+        if self.candidates is None:
+            return found
+        remaining = len(self.patterns) - len(found)
+        overlap = self.longest - 1
+        tail = ''
+        for chunk in chunks:
+            buffer = tail + chunk
+            for candidate in self.candidates.finditer(buffer):
+                position = candidate.start()
+                for pattern in self.by_first_char[buffer[position]]:
+                    if pattern not in found and buffer.startswith(pattern, position):
+                        found.add(pattern)
+                        remaining -= 1
+                if not remaining:
+                    return found # Every pattern has been found so there is nothing left to scan for
+            tail = buffer[-overlap:] if overlap else ''
+        return found
+
+
+class ControlRegistry():
+    """
+    Map evidence patterns to the control functions that process them.
+
+    Each entry ties a platform and control category to one or more search patterns and a handler. Handlers may be
+    callables or 'module:function' strings which are only imported once their patterns match some evidence.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.matcher = None
+
+    def register(self, platform, control, patterns, handler=None):
+        """
+        Register a control function.
+
+        Parameters:
+        platform: Platform name, e.g. 'linux'.
+        control: Control category, e.g. 'connection'.
+        patterns: Search string, or list of search strings that must all be present in the evidence.
+        handler: Callable taking the evidence, or 'module:function' string. Defaults to the function named after the
+        platform in audit_inspector.controls.<control>.
+        """
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        if handler is None:
+            handler = f'audit_inspector.controls.{control}:{platform}'
+        self.entries.append({'platform': platform, 'control': control, 'patterns': list(patterns), 'handler': handler})
+        self.matcher = None # Rebuilt on the next match
+
+    def finalizer(self, control):
+        """
+        Find the run-level finalize step of a control: a 'finalize' function in the module of its handlers, called with
+        the records of every evidence file once all of them have been processed.
+
+        Returns:
+        The finalize function or None.
+        """
+        for entry in self.entries:
+            if entry['control'] == control and entry['handler'] is not None:
+                module = module_of(entry['handler'])
+                finalize = getattr(module, 'finalize', None)
+                if finalize is not None:
+                    return finalize
+        return None
+
+    def incremental_finalizer(self, control):
+        """
+        Find a finalize step for repeated runs over mostly the same records, as in watch mode: the object returned by an
+        'incremental_finalizer' function in the module of the control's handlers, which keeps state between calls.
+        Controls without one use their finalize function.
+
+        Returns:
+        The finalize callable or None.
+        """
+        for entry in self.entries:
+            if entry['control'] == control and entry['handler'] is not None:
+                make_finalizer = getattr(module_of(entry['handler']), 'incremental_finalizer', None)
+                if make_finalizer is not None:
+                    return make_finalizer()
+        return self.finalizer(control)
+
+    def match(self, source):
+        """
+        Find the registry entries whose patterns are all present in the evidence.
+
+        Parameters:
+        source: Evidence text (str), path to an evidence file or evidence.Evidence.
+
+        Returns:
+        List of matching entries in registration order.
+        """
+        if self.matcher is None:
+            self.matcher = PatternMatcher(p for entry in self.entries for p in entry['patterns'])
+        found = self.matcher.search(iter_chunks(source))
+        return [entry for entry in self.entries if all(p in found for p in entry['patterns'])]
+
+    def dispatch(self, source, entries=None):
+        """
+        Call every control function whose patterns match the evidence, each exactly once. A control registered with
+        several alternative patterns is called once when more than one of them matches.
+
+        Parameters:
+        source: Evidence text (str), path to an evidence file or evidence.Evidence.
+        entries: Entries already found by match() for the source, matched here when None.
+
+        Returns:
+        List of the control function returns.
+        """
+        test_results = []
+        try:
+            if entries is None:
+                with profiling.stage('dispatch'):
+                    entries = self.match(source)
+            called = set()
+            for entry in entries:
+                handler = resolve_handler(entry)
+                if handler is None: # Control category exists but this platform isn't implemented yet
+                    continue
+                if (entry['platform'], entry['control'], handler) in called:
+                    continue
+                called.add((entry['platform'], entry['control'], handler))
+                with profiling.stage(f"control:{entry['control']}.{entry['platform']}"):
+                    result = handler(source)
+                if isinstance(result, list): # Controls reporting on many objects return one result per object
+                    test_results.extend(result)
+                elif result:
+                    test_results.append(result)
+        finally:
+            cache.forget() # Controls share one parsed object per evidence file, release it
+            if isinstance(source, evidence.Evidence):
+                source.close()
+        return test_results
+
+
+def module_of(handler):
+    if isinstance(handler, str):
+        return importlib.import_module(handler.partition(':')[0])
+    return sys.modules.get(handler.__module__)
+
+
+def resolve_handler(entry):
+    """
+    Import the handler of a registry entry if needed.
+
+    Returns:
+    The handler callable, or None if the module doesn't define it.
+    """
+    handler = entry['handler']
+    if isinstance(handler, str):
+        module_name, _, function_name = handler.partition(':')
+        handler = getattr(importlib.import_module(module_name), function_name, None)
+        entry['handler'] = handler
+    return handler
+
+
+def iter_chunks(source):
+    """
+    Yield evidence text in chunks.
+
+    Parameters:
+    source: Evidence text (str), path to an evidence file or evidence.Evidence.
+    """
+    if isinstance(source, str):
+        yield source
+    else:
+        yield from evidence.iter_text_chunks(source, chunk_size)
+
+
+def load_plugins(registry):
+    """
+    Let installed plugins register their own controls.
+
+    Plugins expose a function under the 'audit_inspector.plugins' entry point group. It is called with the registry
+    and can call registry.register() for each control it provides.
+    """
+    from importlib import metadata # Only needed once per process, when the registry is built
+    for entry_point in metadata.entry_points(group='audit_inspector.plugins'):
+        entry_point.load()(registry)
+
+
+def default_registry():
+    """
+    Build the registry from settings.control_categories and any installed plugins.
+    """
+    registry = ControlRegistry()
+    for platform, control in settings.control_categories.items():
+        for key, patterns in control.items():
+            for alternative in patterns if isinstance(patterns, tuple) else [patterns]:
+                registry.register(platform, key, alternative)
+    load_plugins(registry)
+    return registry
+
+
+registry = None
+
+
+def get_registry():
+    """
+    Return the default registry, building it on first use.
+    """
+    global registry
+    if registry is None:
+        registry = default_registry()
+    return registry
+
+
+def register(platform, control, patterns, handler=None):
+    """
+    Register a control function with the default registry. See ControlRegistry.register().
+    """
+    get_registry().register(platform, control, patterns, handler)
@@ -0,0 +1,207 @@
+"""
+Evidence sources inside archives and compressed files.
+
+Evidence arrives as plain .txt files or bundled in .zip, .tar, .tar.gz/.tgz archives or as .txt.gz files. Everything
+that reads evidence takes either its text (str), the Path of a plain file or an Evidence, and reads files through
+open_evidence(), so archive members are read straight from the archive without extracting them to disk.
+
+.zip and .tar archives allow random access, so each member is a separate Evidence that any worker process can open
+on its own. A compressed tar can only be read from the start, so a .tar.gz is one unit of work whose members are
+read in a single pass by iter_evidence().
+"""
+import codecs
+import gzip
+import io
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+
+evidence_suffix = '.txt'
+archive_suffixes = ('.zip', '.tar', '.tar.gz', '.tgz', '.txt.gz')
+block_size = 1024 * 1024
+spool_size = 64 * 1024 * 1024 # Decompressed evidence larger than this is spooled to a temporary file rather than memory
+archive_errors = (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) # Raised by corrupt or truncated archives
+
+
+class Evidence():
+    """
+    A .txt.gz file or a text member of an archive.
+
+    The archive is opened on first read and kept open for the following reads of the same Evidence. Compressed data
+    can't be seeked without decompressing it again from the start, and the parsers read sections by offset, so a
+    .txt.gz file or a .zip member is decompressed once, in one sequential pass, into a spooled temporary file. Instances are pickled as their location only,
+    so they can be handed to worker processes which open the archive themselves.
+
+    Parameters:
+    path: Path of the archive or .txt.gz file.
+    member: Name of the member inside a .zip or .tar archive.
+    offset: Position of the member data in a .tar archive.
+    size: Size of the member data in a .tar archive.
+    data: Content of a member already read from a compressed tar, as bytes.
+    """
+
+    def __init__(self, path, member=None, offset=None, size=None, data=None):
+        self.path = Path(path)
+        self.member = member
+        self.offset = offset
+        self.size = size
+        self.data = data
+        self.handle = None
+        self.archive = None
+
+    def __reduce__(self):
+        return (Evidence, (self.path, self.member, self.offset, self.size, self.data))
+
+    def __eq__(self, other):
+        return isinstance(other, Evidence) and (self.path, self.member) == (other.path, other.member)
+
+    def __hash__(self):
+        return hash((self.path, self.member))
+
+    def __str__(self):
+        return f'{self.path}/{self.member}' if self.member else str(self.path)
+
+    def __repr__(self):
+        return f'Evidence({str(self)!r})'
+
+    @property
+    def name(self):
+        return Path(self.member).name if self.member else self.path.name
+
+    def file(self):
+        """
+        Returns:
+        The open binary file of the content, positioned at the start.
+        """
+        if self.handle is None:
+            if self.data is not None:
+                self.handle = io.BytesIO(self.data)
+            elif self.offset is not None:
+                self.archive = open(self.path, 'rb')
+                self.handle = io.BufferedReader(TarMember(self.archive, self.offset, self.size), block_size)
+            else:
+                self.handle = tempfile.SpooledTemporaryFile(spool_size)
+                if self.member is None:
+                    with gzip.open(self.path, 'rb') as f:
+                        shutil.copyfileobj(f, self.handle, block_size)
+                else:
+                    with zipfile.ZipFile(self.path) as archive, archive.open(self.member) as f:
+                        shutil.copyfileobj(f, self.handle, block_size)
+        self.handle.seek(0)
+        return self.handle
+
+    def close(self):
+        for f in (self.handle, self.archive):
+            if f is not None:
+                f.close()
+        self.handle = self.archive = None
+
+
+class TarMember(io.RawIOBase):
+    """
+    Read-only view of one member's data in an uncompressed tar file. It is unbuffered, Evidence.file() wraps it in a
+    BufferedReader so reading lines doesn't cost a seek and read per byte.
+    """
+
+    def __init__(self, f, offset, size):
+        self.f = f
+        self.offset = offset
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            position += self.position
+        elif whence == io.SEEK_END:
+            position += self.size
+        self.position = min(max(position, 0), self.size)
+        return self.position
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self.size - self.position)
+        if length <= 0:
+            return 0
+        self.f.seek(self.offset + self.position)
+        data = self.f.read(length)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+@contextmanager
+def open_evidence(source):
+    """
+    Open evidence for reading as bytes.
+
+    Parameters:
+    source: Path of a plain evidence file, or an Evidence.
+    """
+    if isinstance(source, Evidence):
+        yield source.file() # Kept open for the next read, closed by Evidence.close()
+    else:
+        with open(source, 'rb') as f:
+            yield f
+
+
+def iter_text_chunks(source, chunk_size=block_size):
+    """
+    Yield the text of a file source in chunks, decoding incrementally.
+    """
+    with open_evidence(source) as f:
+        decoder = codecs.getincrementaldecoder('utf8')(errors='replace')
+        for data in iter(lambda: f.read(chunk_size), b''):
+            yield decoder.decode(data)
+        yield decoder.decode(b'', final=True)
+
+
+def is_evidence_name(name):
+    return name.endswith(evidence_suffix) and not name.startswith('.') and '/.' not in name and '__MACOSX' not in name
+
+
+def list_archive(path):
+    """
+    List the evidence in a file: the file itself, or each text member of an archive.
+
+    Returns:
+    List of Path or Evidence sources, in archive order. A .tar.gz is returned whole, see iter_evidence().
+
+    Raises:
+    One of archive_errors when the archive is corrupt, truncated or unreadable.
+    """
+    path = Path(path)
+    name = path.name.lower()
+    if name.endswith('.txt.gz'):
+        return [Evidence(path)]
+    if name.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            return [Evidence(path, info.filename) for info in archive.infolist() if not info.is_dir() and is_evidence_name(info.filename)]
+    if name.endswith('.tar'):
+        with tarfile.open(path, 'r:') as archive:
+            return [Evidence(path, info.name, info.offset_data, info.size) for info in archive if info.isfile() and is_evidence_name(info.name)]
+    return [path]
+
+
+def iter_evidence(source):
+    """
+    Yield the evidence in a source, reading a compressed tar one member at a time in a single pass.
+    """
+    name = Path(str(source)).name.lower()
+    if not isinstance(source, Evidence) and name.endswith(('.tar.gz', '.tgz')):
+        with tarfile.open(source, 'r|*') as archive:
+            for info in archive:
+                if info.isfile() and is_evidence_name(info.name):
+                    yield Evidence(source, info.name, data=archive.extractfile(info).read())
+    else:
+        yield source
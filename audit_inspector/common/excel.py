@@ -0,0 +1,127 @@
+import itertools
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, NamedStyle
+from openpyxl.utils import get_column_letter
+from audit_inspector.common import settings
+
+sample_size = 500 # Rows sampled per sheet to size the columns
+max_column_width = 80
+
+
+def format_value(value):
+    """
+    Returns:
+    Value as it is written to a cell. Lists are written one item per line.
+    """
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return '\n'.join(str(item) for item in value)
+    return value
+
+
+def column_widths(headers, rows):
+    """
+    Fit column widths to the headers and a sample of the rows.
+
+    Returns:
+    List of widths, one per header.
+    """
+    widths = [len(header) + 4 for header in headers] # Room for the larger header font
+    for row in rows:
+        for i, header in enumerate(headers):
+            value = row.get(header)
+            if value is None:
+                continue
+            longest = max((len(line) for line in str(format_value(value)).split('\n')), default=0)
+            widths[i] = min(max(widths[i], longest + 2), max_column_width)
+    return widths
+
+
+def header_cells(sheet, headers, style):
+    cells = []
+    for header in headers:
+        cell = WriteOnlyCell(sheet, value=header)
+        cell.style = style
+        cells.append(cell)
+    return cells
+
+
+def body_cells(sheet, headers, row, style):
+    cells = []
+    for header in headers:
+        value = row.get(header)
+        if isinstance(value, (list, tuple)): # Only multi-line cells need wrapping
+            cell = WriteOnlyCell(sheet, value=format_value(value))
+            cell.style = style
+            cells.append(cell)
+        else:
+            cells.append(value)
+    return cells
+
+
+def group_rows(store, column):
+    """
+    Group the rows of a store by a column, e.g. hosts by the fingerprint of their configuration.
+
+    Returns:
+    List of {<column>:, 'Hosts':, 'Hostname':, 'Notes':} rows, largest group first. Notes are the distinct notes of
+    the group's rows. Rows without a value are left out.
+    """
+    grouped = []
+    for value, indexes in store.group_by(column).items():
+        if value is None:
+            continue
+        hostnames = []
+        notes = {}
+        for row in store.rows(indexes):
+            hostnames.append(row.get('Hostname'))
+            notes.update(dict.fromkeys(row.get('Notes') or []))
+        grouped.append({column: value, 'Hosts': len(indexes), 'Hostname': hostnames, 'Notes': list(notes)})
+    grouped.sort(key=lambda row: row['Hosts'], reverse=True)
+    return grouped
+
+
+def write_workbook(results, path):
+    """
+    Write the results to an Excel workbook with one sheet per control.
+
+    The workbook is written in openpyxl's write-only mode, which streams rows to disk as they are appended so memory
+    use doesn't grow with the number of rows. Styles are registered once as named styles and cells refer to them by
+    name. Column widths are fitted from a sample of each sheet's rows since the rows can't be revisited once written.
+    Controls in settings.report_groups get a second sheet with one row per distinct value of the grouping column.
+
+    Parameters:
+    results: ResultSet
+    path: Path of the .xlsx file to write.
+    """
+    workbook = Workbook(write_only=True)
+    header_style = NamedStyle(name='report header', font=settings.header_font, fill=settings.dark_blue_fill)
+    body_style = NamedStyle(name='report body', alignment=Alignment(vertical='top', wrap_text=True))
+    workbook.add_named_style(header_style)
+    workbook.add_named_style(body_style)
+
+    for store in results:
+        sheet = workbook.create_sheet(title=store.control[:31])
+        headers = settings.report_headers.get(store.control) or list(store.columns)
+        for i, width in enumerate(column_widths(headers, itertools.islice(store.rows(), sample_size)), start=1):
+            sheet.column_dimensions[get_column_letter(i)].width = width
+        sheet.freeze_panes = 'A2'
+
+        sheet.append(header_cells(sheet, headers, header_style.name))
+        for row in store.rows():
+            sheet.append(body_cells(sheet, headers, row, body_style.name))
+
+        column = settings.report_groups.get(store.control)
+        if column in store.columns:
+            grouped = group_rows(store, column)
+            headers = [column, 'Hosts', 'Hostname', 'Notes']
+            sheet = workbook.create_sheet(title=f'{store.control} groups'[:31])
+            for i, width in enumerate(column_widths(headers, grouped[:sample_size]), start=1):
+                sheet.column_dimensions[get_column_letter(i)].width = width
+            sheet.freeze_panes = 'A2'
+            sheet.append(header_cells(sheet, headers, header_style.name))
+            for row in grouped:
+                sheet.append(body_cells(sheet, headers, row, body_style.name))
+    workbook.save(path)
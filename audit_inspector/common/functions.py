@@ -1,16 +1,100 @@
+import codecs
+import hashlib
 import json
-from pathlib import Path
 import re
 import itertools
-from collections import abc
-from dateutil import parser
-from audit_inspector.common.settings import control_categories, header_font, dark_blue_fill
-from openpyxl.utils import get_column_letter
+from collections import abc, namedtuple
+from audit_inspector.common import evidence, profiling
+
+# A command and the output it produced. Commands are recorded in the evidence on lines beginning with a plus sign.
+Section = namedtuple('Section', ['command', 'output'])
+# Where a section's output is in the evidence: character offsets for text, byte offsets for files.
+SectionSpan = namedtuple('SectionSpan', ['command', 'start', 'end'])
+section_marker = re.compile(r'^\++[ \t]', re.MULTILINE)
+binary_section_marker = re.compile(rb'^\++[ \t]')
+
+
+def index_sections(source):
+    """
+    Find every section in the evidence without reading the section output.
+
+    Parameters:
+    source: Evidence text (str), the path to an evidence file or an evidence.Evidence.
+
+    Returns:
+    List of SectionSpan tuples of (command, start, end) locating the output of each section, for read_section().
+    """
+    with profiling.stage('tokenize'):
+        return _index_sections(source)
+
+
+def _index_sections(source):
+    spans = []
+    if isinstance(source, str):
+        start = 0
+        markers = [marker.start() for marker in section_marker.finditer(source)] + [len(source)]
+        for end in markers:
+            if end > start or end == len(source):
+                command_end = source.find('\n', start, end)
+                if command_end == -1:
+                    command_end = end
+                command = source[start:command_end].lstrip('+ \t').strip()
+                if command or command_end + 1 < end:
+                    spans.append(SectionSpan(command, min(command_end + 1, end), end))
+            start = end
+        return spans
+    with evidence.open_evidence(source) as f:
+        command = None
+        start = position = 0
+        for line in f:
+            if command is None or binary_section_marker.match(line):
+                if command or position > start:
+                    spans.append(SectionSpan(command, start, position))
+                command = line.decode('utf8', errors='replace').lstrip('+ \t').strip()
+                start = position + len(line)
+            position += len(line)
+        if command or position > start:
+            spans.append(SectionSpan(command, start, position))
+    return spans
+
+
+def read_section(source, span):
+    """
+    Returns:
+    Section with the output of an indexed section.
+    """
+    with profiling.stage('read'):
+        return Section(span.command, ''.join(iter_section_chunks(source, span)))
+
+
+def iter_section_chunks(source, span, chunk_size=1024 * 1024):
+    """
+    Yield the output of an indexed section in chunks so large output can be processed without reading it whole.
+
+    Parameters:
+    source: Evidence text (str), the path to an evidence file or an evidence.Evidence.
+    span: SectionSpan from index_sections().
+    """
+    if isinstance(source, str):
+        yield source[span.start:span.end]
+        return
+    with evidence.open_evidence(source) as f:
+        f.seek(span.start)
+        decoder = codecs.getincrementaldecoder('utf8')(errors='replace')
+        remaining = span.end - span.start
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield decoder.decode(data, final=remaining <= 0).replace('\r\n', '\n')
+
 
 def get_evidence_date(datestring):
     """
     Parse the output of the 'date' command and return as a datetime object.
     """
+    from dateutil import parser # Imported on first use, most controls never need it
     raw_date = parser.parse(datestring, ignoretz=True)
     evidence_date = raw_date.strftime('%m/%d/%Y')
     return evidence_date
@@ -21,16 +105,123 @@ def get_hostname(output):
     return hostname
 
     
-def section_text_to_json(section):
+def section_text_to_json(output):
     """
-    Converts command output from text to YAML which can be parsed as a dictionary.
+    Converts command output from JSON to dictionaries, one resource at a time.
+
+    kubectl returns a single object with the resources in its 'items' array. Arrays at the top level of the output are
+    decoded one element at a time so only a single resource is held as Python objects, never the full object tree.
+
+    Parameters:
+    output: Section output as a str, or an iterable of str chunks such as iter_section_chunks() returns.
+    """
+    for entry in iter_json_items(output):
+        if 'List' not in entry: # Kubernetes adds 
+            yield entry
+
+
+json_decoder = json.JSONDecoder()
+json_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+def iter_json_items(source):
+    """
+    Incrementally decode the objects inside the top-level arrays of a JSON document.
+
+    Parameters:
+    source: JSON text (str), or an iterable of str chunks that together make up the JSON text.
+
+    Returns:
+    Each dictionary found in an array at the top level of the document. Other top-level values are decoded and
+    discarded.
+    """
+    stream = JsonStream([source] if isinstance(source, str) else source)
+    first = stream.peek()
+    if first == '{':
+        stream.expect('{')
+        while stream.peek() != '}':
+            stream.decode() # key
+            stream.expect(':')
+            if stream.peek() == '[':
+                yield from stream.iter_array()
+            else:
+                stream.decode()
+            if stream.peek() == ',':
+                stream.expect(',')
+        stream.expect('}')
+    elif first == '[':
+        yield from stream.iter_array()
+
+
+class JsonStream():
+    """
+    Read JSON values one at a time from a sequence of text chunks, keeping only unread text in memory.
     """
-    data = json.loads(section.group('output'))
-    if data: # if there is some error in conversion, skip
-        for k,v in data.items():
-            for entry in v:
-                if (isinstance(entry, dict)) and 'List' not in entry: # Kubernetes adds 
-                    yield entry
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+        self.pos = 0
+        self.exhausted = False
+
+    def fill(self):
+        """
+        Append the next chunk to the buffer, dropping text that has already been read.
+
+        Returns:
+        False when there is no more input.
+        """
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer = self.buffer[self.pos:] + chunk
+                self.pos = 0
+                return True
+        self.exhausted = True
+        return False
+
+    def peek(self):
+        """
+        Returns:
+        The next non-whitespace character without consuming it, or '' at the end of the input.
+        """
+        while True:
+            self.pos = json_whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f'Expecting {char!r}', self.buffer, self.pos)
+        self.pos += 1
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.fill(): # The value may continue in the next chunk
+                    continue
+                raise
+            if end == len(self.buffer) and not self.exhausted and self.fill():
+                continue # A number or literal ending the buffer may continue in the next chunk
+            self.pos = end
+            return value
+
+    def iter_array(self):
+        """
+        Decode the array at the current position and yield its dictionaries one at a time.
+        """
+        self.expect('[')
+        while self.peek() != ']':
+            item = self.decode()
+            if isinstance(item, dict):
+                yield item
+            if self.peek() == ',':
+                self.expect(',')
+        self.expect(']')
 
 
 def traverse(o):
@@ -54,31 +245,171 @@ def dict_keys(nested):
         else:
             yield key,value
 
-def process_openssl_output(connectionDetails, platform, date, section_text, section_command):
+openssl_connect = re.compile(r'-connect\s+(\S+)')
+openssl_connecting = re.compile(r'^Connecting to\s+(\S+)')
+openssl_field = re.compile(r'^\s*(Protocol|Cipher)\s+:\s*(\S*)')
+# Oldest to newest, protocols not listed sort first
+tls_versions = ['SSLv2', 'SSLv3', 'TLSv1', 'TLSv1.1', 'TLSv1.2', 'TLSv1.3']
+
+
+def process_openssl_output(platform, date, section_text, section_command, records=None):
     """
     Parse OpenSSL s_client output and return relevant information.
 
-    The command in requests.xlsx ends up returning multiple sections separated by a plus sign. This function returns them in the
-                   
+    The output is read once, line by line. It may hold many handshakes, e.g. from a loop over targets and protocol
+    versions. A handshake's target comes from the most recent '-connect <target>' line in the output, or from the
+    -connect argument of the command. OpenSSL 3.2 and later print 'Connecting to <address>' for every connection, so
+    those lines only name the target when the command has no -connect or the output holds several connections, and
+    never right after the -connect line of the same connection. Every accepted protocol/cipher pair is added to the
+    record of its target, and every target tested gets a record even when it accepted nothing.
+
+    Parameters:
+    records: Dictionary of {<Hostname>: <record>} to add to, so output for one target spread over several sections
+    ends up in one record.
+
+    Returns:
+    {<Hostname>: {<Platform>:<string>, <Hostname>:<string>, <Date>:<datetime>, <Protocol>:<string>, <Version>:<float>, <Cipher>:<string>, <Available Ciphers>:<list>}}
+    """
+    if records is None:
+        records = {}
+    command_target = openssl_connect.search(section_command)
+    target = command_target.group(1) if command_target else ''
+    sweep = section_text.startswith('Connecting to') + section_text.count('\nConnecting to') > 1
+    follow_connecting = sweep or not command_target
+    announced = False # The target came from a -connect line and its 'Connecting to' line hasn't been seen yet
+    protocol = ''
+    updated = set()
+    tested = {} # Targets named in the output, in order
+    for line in section_text.splitlines():
+        connect = openssl_connect.search(line)
+        if connect:
+            target = connect.group(1)
+            tested[target] = None
+            announced = True
+            protocol = ''
+            continue
+        connecting = openssl_connecting.match(line)
+        if connecting:
+            if follow_connecting and not announced:
+                target = connecting.group(1)
+                tested[target] = None
+                protocol = ''
+            announced = False
+            continue
+        field = openssl_field.match(line)
+        if not field:
+            continue
+        if field.group(1) == 'Protocol': # This line contains the TLS version and the next the cipher
+            protocol = field.group(2)
+        elif protocol:
+            cipher = field.group(2)
+            if cipher and '0000' not in cipher and cipher != '(NONE)': # 0000 means no connection was made
+                record = records.get(target)
+                if record is None:
+                    record = records[target] = {'Platform': platform, 'Hostname': target, 'Date': date, 'Protocol': 'TLS', 'Available Ciphers': []}
+                if f'{protocol}:{cipher}' not in record['Available Ciphers']:
+                    record['Available Ciphers'].append(f'{protocol}:{cipher}')
+                updated.add(target)
+            protocol = ''
+    if not tested and target: # The only target is the command's
+        tested[target] = None
+    for target in tested: # Nothing was negotiated but the target was still tested
+        if target not in records:
+            records[target] = {'Platform': platform, 'Hostname': target, 'Date': date, 'Protocol': 'TLS', 'Available Ciphers': []}
+    for target in updated:
+        select_negotiated(records[target])
+    return records
+
+
+def tls_version_rank(protocol):
+    return tls_versions.index(protocol) if protocol in tls_versions else -1
+
+
+def select_negotiated(record):
+    """
+    Set Version and Cipher to the highest protocol version accepted, which is what a client negotiates by default.
+    """
+    best = max(record['Available Ciphers'], key=lambda pair: tls_version_rank(pair.split(':')[0]))
+    protocol, _, cipher = best.partition(':')
+    record['Version'] = protocol.split('v')[-1]
+    record['Cipher'] = cipher
+
+
+# sshd -T keywords whose value is a comma separated list
+sshd_list_keywords = {'ciphers', 'macs', 'kexalgorithms', 'hostkeyalgorithms', 'pubkeyacceptedkeytypes', 'pubkeyacceptedalgorithms', 'casignaturealgorithms', 'authenticationmethods'}
+# sshd -T keywords with a numeric value
+sshd_int_keywords = {'port', 'clientaliveinterval', 'clientalivecountmax', 'logingracetime', 'maxauthtries', 'maxsessions', 'x11displayoffset'}
+# sshd -T keywords that can appear more than once, e.g. one 'port' line per listening port
+sshd_repeated_keywords = {'port', 'listenaddress', 'hostkey', 'acceptenv', 'subsystem', 'setenv'}
+ssh_debug_cipher = re.compile(r'kex: server->client cipher:\s([a-z]\S*)')
+
+
+def normalize_sshd_config(output):
+    """
+    Returns:
+    'sshd -T' output without blank lines or comments and with runs of whitespace made single spaces, so the output of
+    hosts with the same configuration is identical.
+    """
+    lines = []
+    for line in output.splitlines():
+        line = ' '.join(line.split())
+        if line and not line.startswith('#'):
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+def config_fingerprint(normalized):
+    """
+    Returns:
+    Short hex digest identifying a normalized configuration.
+    """
+    return hashlib.blake2b(normalized.encode('utf8'), digest_size=8).hexdigest()
+
+
+def parse_sshd_config(output):
+    """
+    Tokenize 'sshd -T' output into a configuration map in one pass over its lines.
+
+    Keywords are lower case. Values of the keywords in sshd_list_keywords are lists, those in sshd_int_keywords are
+    integers, those in sshd_repeated_keywords are lists of every value given, and the rest are strings.
+
+    Returns:
+    {<keyword>: <value>}
+    """
+    config = {}
+    for line in output.splitlines():
+        keyword, _, value = line.strip().partition(' ')
+        if not keyword or keyword.startswith('#'):
+            continue
+        keyword = keyword.lower()
+        value = value.strip()
+        if keyword in sshd_list_keywords:
+            value = [item for item in value.split(',') if item]
+        elif keyword in sshd_int_keywords:
+            try:
+                value = int(value)
+            except ValueError:
+                pass
+        if keyword in sshd_repeated_keywords:
+            config.setdefault(keyword, []).append(value)
+        else:
+            config[keyword] = value
+    return config
+
+
+def parse_ssh_debug(output):
+    """
+    Tokenize 'ssh -v' output in one pass over its lines.
+
     Returns:
-    {<Platform>:<string>, <Hostname>:<string>, <Date>:<datetime>, <Protocol>:<string>, <Version>:<float>, <Cipher>:<string>, <Available Ciphers>:<list>}
-    """
-    connectionDetails['Platform'] = platform
-    connectionDetails['Hostname'] = re.search(r'-connect\s+(.*)\s+', section_command).group(1)
-    connectionDetails['Date'] = date
-    connectionDetails['Protocol'] = 'TLS'
-                    
-    for line in section_text.split('\n'): # Convert output string to a list of strings
-        protocol = ''
-        if re.search(r'Protocol\s+:', line): # This line contains the TLS version
-            protocol = line.split(':')[1].strip()
-            i = section_text.split('\n').index(line) # The next list item holds Cipher info so get index of the item
-            if '0000' not in section_text.split('\n')[i+1]: # 0000 means no connection was made
-                connectionDetails['Available Ciphers'].append("" + protocol + ':' + section_text.split('\n')[i+1].split(':')[1].strip() + "")
-
-    version = float()
-    for protocol in connectionDetails['Available Ciphers']:
-        if float(protocol.split(':')[0].split('v')[1]) > version:
-            connectionDetails['Version'] = protocol.split(':')[0].split('v')[1] # default is highest available
-            connectionDetails['Cipher'] = protocol.split(':')[1]
-    return connectionDetails
\ No newline at end of file
+    {'version': <int>, 'cipher': <string>}, cipher only if the key exchange was logged.
+    """
+    details = {'version': 1}
+    for line in output.splitlines():
+        if 'SSH2' in line:
+            details['version'] = 2
+        if 'cipher' not in details and 'kex: server->client' in line:
+            cipher = ssh_debug_cipher.search(line)
+            if cipher:
+                details['cipher'] = cipher.group(1)
+    return details
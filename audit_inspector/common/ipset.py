@@ -0,0 +1,160 @@
+import bisect
+import ipaddress
+
+
+class IPSet():
+    """
+    Set of IPv4 and IPv6 addresses stored as sorted, non-overlapping integer ranges.
+
+    Set operations merge the sorted ranges of both sets in a single sweep, so union, difference and intersection of
+    sets holding n ranges cost O(n log n) to build and O(n) to combine, however large the address ranges are.
+    """
+
+    __slots__ = ('ranges',)
+
+    def __init__(self, networks=()):
+        """
+        Parameters:
+        networks: Iterable of CIDR strings or ipaddress network objects.
+        """
+        self.ranges = {4: [], 6: []} # version -> sorted list of (first, last) inclusive integer ranges
+        collected = {4: [], 6: []}
+        for network in networks:
+            network = ipaddress.ip_network(network, strict=False)
+            collected[network.version].append((int(network.network_address), int(network.broadcast_address)))
+        for version, ranges in collected.items():
+            self.ranges[version] = merge_ranges(sorted(ranges))
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        ipset = cls()
+        ipset.ranges = ranges
+        return ipset
+
+    def __bool__(self):
+        return bool(self.ranges[4] or self.ranges[6])
+
+    def __eq__(self, other):
+        return isinstance(other, IPSet) and self.ranges == other.ranges
+
+    def __repr__(self):
+        return f"IPSet({[str(network) for network in self.cidrs()]})"
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __sub__(self, other):
+        return self.difference(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def __contains__(self, address):
+        """
+        Parameters:
+        address: IP address string or ipaddress object, or a CIDR which must be entirely inside the set.
+        """
+        network = ipaddress.ip_network(address, strict=False)
+        first = int(network.network_address)
+        last = int(network.broadcast_address)
+        ranges = self.ranges[network.version]
+        i = bisect.bisect_right(ranges, (first, float('inf'))) - 1
+        return i >= 0 and ranges[i][0] <= first and last <= ranges[i][1]
+
+    def union(self, other):
+        return IPSet.from_ranges({v: merge_ranges(sorted(self.ranges[v] + other.ranges[v])) for v in (4, 6)})
+
+    def difference(self, other):
+        return IPSet.from_ranges({v: subtract_ranges(self.ranges[v], other.ranges[v]) for v in (4, 6)})
+
+    def intersection(self, other):
+        return IPSet.from_ranges({v: intersect_ranges(self.ranges[v], other.ranges[v]) for v in (4, 6)})
+
+    def cidrs(self):
+        """
+        Returns:
+        List of the smallest set of CIDR networks covering exactly the addresses in the set, IPv4 first.
+        """
+        networks = []
+        for version, address_class in ((4, ipaddress.IPv4Address), (6, ipaddress.IPv6Address)):
+            for first, last in self.ranges[version]:
+                networks.extend(ipaddress.summarize_address_range(address_class(first), address_class(last)))
+        return networks
+
+    def num_addresses(self):
+        return sum(last - first + 1 for ranges in self.ranges.values() for first, last in ranges)
+
+
+def merge_ranges(ranges):
+    """
+    Merge sorted (first, last) ranges that overlap or touch.
+    """
+    merged = []
+    for first, last in ranges:
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def subtract_ranges(ranges, removed):
+    """
+    Remove one list of merged ranges from another in a single sweep.
+    """
+    result = []
+    j = 0
+    for first, last in ranges:
+        while j < len(removed) and removed[j][1] < first: # Skip removals entirely before this range
+            j += 1
+        k = j
+        while k < len(removed) and removed[k][0] <= last:
+            if removed[k][0] > first:
+                result.append((first, removed[k][0] - 1))
+            first = max(first, removed[k][1] + 1)
+            if first > last:
+                break
+            k += 1
+        if first <= last:
+            result.append((first, last))
+    return result
+
+
+def intersect_ranges(ranges, other):
+    """
+    Intersect two lists of merged ranges in a single sweep.
+    """
+    result = []
+    i = j = 0
+    while i < len(ranges) and j < len(other):
+        first = max(ranges[i][0], other[j][0])
+        last = min(ranges[i][1], other[j][1])
+        if first <= last:
+            result.append((first, last))
+        if ranges[i][1] < other[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def ip_block(cidr, exceptions=()):
+    """
+    Build the set of addresses a Kubernetes ipBlock selects.
+
+    Parameters:
+    cidr: CIDR of the block.
+    exceptions: CIDRs excluded from the block.
+
+    Returns:
+    IPSet
+    """
+    return IPSet([cidr]) - IPSet(exceptions or [])
+
+
+everywhere = IPSet(['0.0.0.0/0', '::/0'])
+# Publicly routable IPv4 space, everything but the RFC 1918 private ranges
+internet = IPSet(['0.0.0.0/0']) - IPSet(['10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16'])
+# Publicly routable IPv6 space, the global unicast range. Unique local (fc00::/7) and link-local (fe80::/10) are outside it
+internet6 = IPSet(['2000::/3'])
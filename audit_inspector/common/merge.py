@@ -0,0 +1,92 @@
+"""
+Join partial records of the same host that come from different evidence files.
+
+The evidence for one server is often split across files, e.g. the 'ssh -v' negotiation in one and the 'sshd -T'
+dump in another, and each file yields a record with only the fields it has evidence for. merge_records() hash joins
+them on the normalized (Platform, Hostname, Date) in one pass, so checks see everything known about the host.
+
+Conflict rule, applied field by field in evidence order (the order files are processed, which is sorted by name):
+- A field missing from a record, or None or '', never overrides a value.
+- Lists are unioned, keeping the order items were first seen, since each item is a separate observation such as an
+  available cipher.
+- For any other value the first one wins. Different later values are reported in the merged record's Notes so the
+  conflict is visible in the report rather than silently dropped.
+"""
+
+key_fields = ('Platform', 'Hostname', 'Date')
+
+
+def normalize(value):
+    """
+    Returns:
+    A join key component: strings are compared case-insensitively without surrounding whitespace or a trailing dot,
+    so 'WEB01.example.com.' and 'web01.example.com' are the same host.
+    """
+    if isinstance(value, str):
+        return value.strip().lower().rstrip('.')
+    return value
+
+
+def is_missing(value):
+    return value is None or value == ''
+
+
+def join_key(record, keys=key_fields):
+    """
+    Returns:
+    The key a record is joined on, or None for a record without a hostname.
+    """
+    if is_missing(record.get('Hostname')):
+        return None
+    return tuple(normalize(record.get(field)) for field in keys)
+
+
+def merge_records(records, keys=key_fields):
+    """
+    Merge the records that share a key.
+
+    Records without a hostname can't be matched to anything and are passed through as they are.
+
+    Parameters:
+    records: Iterable of record dictionaries, in evidence order.
+    keys: Fields the records are joined on.
+
+    Returns:
+    List of merged records, in the order each key was first seen. They are new dictionaries, the records passed in
+    are left as they are.
+    """
+    merged = {} # key -> merged record
+    conflicts = {} # key -> {field: [other values]}
+    order = []
+    for record in records:
+        key = join_key(record, keys)
+        if key is None:
+            order.append(dict(record))
+            continue
+        target = merged.get(key)
+        if target is None:
+            record = merged[key] = dict(record)
+            order.append(record)
+            continue
+        for field, value in record.items():
+            if field in keys or field == 'Notes' or is_missing(value):
+                continue
+            current = target.get(field)
+            if is_missing(current):
+                target[field] = list(value) if isinstance(value, list) else value
+            elif isinstance(current, list) and isinstance(value, list):
+                target[field] = current + [item for item in value if item not in current]
+            elif current != value:
+                values = conflicts.setdefault(key, {}).setdefault(field, [])
+                if value not in values:
+                    values.append(value)
+        if record.get('Notes'):
+            target['Notes'] = (target.get('Notes') or []) + [note for note in record['Notes'] if note not in (target.get('Notes') or [])]
+    for key, fields in conflicts.items():
+        record = merged[key]
+        notes = list(record.get('Notes') or [])
+        for field, values in fields.items():
+            others = ', '.join(str(value) for value in values)
+            notes.append(f"NOTE$$Conflicting {field} values in the evidence for {record['Hostname']}.$$The evidence files have {field} {record[field]} and {others}. The value from the first file, {record[field]}, was used.")
+        record['Notes'] = notes
+    return order
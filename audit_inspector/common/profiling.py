@@ -0,0 +1,228 @@
+"""
+Per-stage and per-file timing for a run, switched on with --profile.
+
+Code marks a stage with 'with profiling.stage(name):'. When profiling is off this costs one global lookup. When it is
+on, each stage records its calls, wall time, self time (its time minus the time spent in stages nested inside it) and
+the net bytes allocated while it ran, traced with tracemalloc. Stages are:
+
+tokenize                        indexing the sections of the evidence
+read                            reading a section of evidence from disk or text
+dispatch                        searching the evidence for the control patterns
+parse:<class>.<field>           parsing a platform class field, e.g. parse:kubernetes.pods
+cache:load                      loading a parsed field from the parse cache
+control:<control>.<platform>    a control function; its self time is the checks since parsing is nested in it
+finalize                        controls' run-level steps, e.g. merging connection records across files and checking them
+"""
+import hashlib
+import json
+import re
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+profiler = None # Active Profiler, None when profiling is off
+top_entries = 30 # Functions or allocation sites reported for each of the slowest files
+
+
+class Profiler():
+    """
+    Collects stage statistics, in total and for each evidence file.
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.files = {}
+        self.current_file = None
+        self.stack = [] # Time spent in nested stages, one entry per open stage
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self):
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def allocated(self):
+        return tracemalloc.get_traced_memory()[0] if self.trace_memory else 0
+
+    @contextmanager
+    def stage(self, name):
+        memory = self.allocated()
+        self.stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            nested = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += seconds
+            allocated = self.allocated() - memory
+            add_stage(self.stages, name, seconds, seconds - nested, allocated)
+            if self.current_file is not None:
+                add_stage(self.files[self.current_file]['stages'], name, seconds, seconds - nested, allocated)
+
+    @contextmanager
+    def file(self, path):
+        """
+        Attribute the stages run inside the block to an evidence file.
+        """
+        path = str(path)
+        self.current_file = path
+        entry = self.files.setdefault(path, {'seconds': 0.0, 'allocated_bytes': 0, 'stages': {}})
+        memory = self.allocated()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry['seconds'] += time.perf_counter() - start
+            entry['allocated_bytes'] += self.allocated() - memory
+            self.current_file = None
+
+    def stats(self):
+        """
+        Returns:
+        {'stages': {...}, 'files': {...}}, the statistics a worker process sends back with its results.
+        """
+        return {'stages': self.stages, 'files': self.files}
+
+    def merge(self, stats):
+        """
+        Add the statistics collected by another process.
+        """
+        for name, entry in stats['stages'].items():
+            add_stage(self.stages, name, entry['seconds'], entry['self_seconds'], entry['allocated_bytes'], entry['calls'])
+        for path, entry in stats['files'].items():
+            if path not in self.files:
+                self.files[path] = {'seconds': 0.0, 'allocated_bytes': 0, 'stages': {}}
+            self.files[path]['seconds'] += entry['seconds']
+            self.files[path]['allocated_bytes'] += entry['allocated_bytes']
+            for name, stage_entry in entry['stages'].items():
+                add_stage(self.files[path]['stages'], name, stage_entry['seconds'], stage_entry['self_seconds'], stage_entry['allocated_bytes'], stage_entry['calls'])
+
+    def slowest(self, count):
+        """
+        Returns:
+        Paths of the count slowest files, slowest first.
+        """
+        return sorted(self.files, key=lambda path: self.files[path]['seconds'], reverse=True)[:count]
+
+
+def add_stage(stages, name, seconds, self_seconds, allocated_bytes, calls=1):
+    entry = stages.get(name)
+    if entry is None:
+        entry = stages[name] = {'calls': 0, 'seconds': 0.0, 'self_seconds': 0.0, 'allocated_bytes': 0}
+    entry['calls'] += calls
+    entry['seconds'] += seconds
+    entry['self_seconds'] += self_seconds
+    entry['allocated_bytes'] += allocated_bytes
+
+
+def stage(name):
+    """
+    Context manager timing a stage when profiling is on.
+    """
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name)
+
+
+def enable(trace_memory=True):
+    """
+    Start profiling in this process. Called in the main process and, through the pool initializer, in each worker.
+
+    Returns:
+    The Profiler.
+    """
+    global profiler
+    profiler = Profiler(trace_memory)
+    profiler.start()
+    return profiler
+
+
+def disable():
+    global profiler
+    if profiler is not None:
+        profiler.stop()
+    profiler = None
+
+
+def collect():
+    """
+    Return the statistics collected in this process since the last call and start over, so a worker can send back
+    the statistics of each file with its results.
+    """
+    stats = profiler.stats()
+    profiler.stages = {}
+    profiler.files = {}
+    return stats
+
+
+def capture(function, path, mode, output_dir):
+    """
+    Run function(path) again under cProfile or tracemalloc.
+
+    Parameters:
+    function: Callable processing one evidence file.
+    path: Evidence file.
+    mode: 'cprofile' or 'tracemalloc'.
+    output_dir: Directory for the .prof file written in cprofile mode.
+
+    Returns:
+    Dictionary describing the capture: the top functions by cumulative time or the top allocation sites by size.
+    """
+    if mode == 'cprofile':
+        import cProfile
+        import io
+        import pstats
+        profile = cProfile.Profile()
+        profile.runcall(function, path)
+        prof_path = Path(output_dir) / prof_name(path)
+        profile.dump_stats(prof_path)
+        text = io.StringIO()
+        pstats.Stats(profile, stream=text).sort_stats('cumulative').print_stats(top_entries)
+        return {'mode': mode, 'file': str(path), 'prof': str(prof_path), 'top': text.getvalue().splitlines()}
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        function(path)
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    ignored = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap>'), tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>')]
+    statistics = snapshot.filter_traces(ignored).statistics('lineno')
+    return {'mode': mode, 'file': str(path), 'peak_bytes': peak, 'top': [str(statistic) for statistic in statistics[:top_entries]]}
+
+
+def prof_name(path):
+    """
+    Returns:
+    File name of the .prof capture of an evidence file: the archive and member names, with a digest of the full path so
+    members with the same name in different archives or directories don't overwrite each other's capture.
+    """
+    location = Path(path.path).name + '/' + path.member if getattr(path, 'member', None) else Path(str(path)).name
+    digest = hashlib.blake2b(str(path).encode('utf8'), digest_size=4).hexdigest()
+    return f"{re.sub(r'[^A-Za-z0-9._-]+', '_', location)}.{digest}.prof"
+
+
+def write_report(path, run_profiler, seconds, captures=()):
+    """
+    Write the profile as JSON: totals per stage, per file with its stages, slowest file first, and any captures.
+    """
+    files = {file_path: run_profiler.files[file_path] for file_path in run_profiler.slowest(len(run_profiler.files))}
+    report = {
+        'seconds': seconds,
+        'trace_memory': run_profiler.trace_memory,
+        'stages': dict(sorted(run_profiler.stages.items(), key=lambda item: item[1]['self_seconds'], reverse=True)),
+        'files': files,
+        'captures': list(captures),
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=4)
@@ -0,0 +1,340 @@
+import sys
+from collections import defaultdict, namedtuple
+from audit_inspector.common import ipset
+
+# A peer a policy rule allows traffic to or from. pods is the set of pod ids it selects and cidr the IPSet of addresses,
+# either may be None. Allowance is one rule of one policy: the peers it allows and on which ports.
+Peer = namedtuple('Peer', ['description', 'pods', 'cidr'])
+Allowance = namedtuple('Allowance', ['policy', 'peers', 'ports'])
+
+empty = frozenset()
+
+
+class LabelTable():
+    """
+    Interned labels of a set of Kubernetes objects.
+
+    Each distinct (key, value) pair is stored once and given an integer id, and each distinct set of labels is kept
+    once as a frozenset of ids. Objects from the same deployment all refer to the same frozenset, and comparing or
+    intersecting label sets is done on small integers rather than strings.
+    """
+
+    __slots__ = ('pairs', 'ids', 'sets')
+
+    def __init__(self):
+        self.pairs = [] # id -> (key, value)
+        self.ids = {} # (key, value) -> id
+        self.sets = {} # frozenset of ids -> the same frozenset
+
+    def id(self, key, value):
+        """
+        Returns:
+        The id of a label, adding it to the table if it is new.
+        """
+        label_id = self.ids.get((key, value))
+        if label_id is None:
+            pair = (sys.intern(str(key)), sys.intern(str(value)))
+            label_id = self.ids[pair] = len(self.pairs)
+            self.pairs.append(pair)
+        return label_id
+
+    def label_set(self, labels):
+        """
+        Parameters:
+        labels: Iterable of (key, value) pairs.
+
+        Returns:
+        Frozenset of label ids, the same object for every equal set.
+        """
+        ids = frozenset(self.id(key, value) for key, value in labels)
+        return self.sets.setdefault(ids, ids)
+
+    def key(self, label_id):
+        return self.pairs[label_id][0]
+
+
+def describe_selector(selector):
+    """
+    Returns:
+    Kubernetes label selector as a short string, e.g. 'app=web,tier In (a,b)'. An empty selector is '*'.
+    """
+    terms = [f'{k}={v}' for k, v in (selector.get('matchLabels') or {}).items()]
+    for expression in selector.get('matchExpressions') or []:
+        values = ','.join(expression.get('values') or [])
+        terms.append(f"{expression.get('key')} {expression.get('operator')}" + (f' ({values})' if values else ''))
+    return ','.join(terms) or '*'
+
+
+def describe_ports(ports):
+    """
+    Returns:
+    List of '<PROTOCOL>/<PORT>' strings for the ports of a policy rule, ['*'] when all ports are allowed.
+    """
+    if not ports:
+        return ['*']
+    described = []
+    for port in ports:
+        number = str(port.get('port', '*'))
+        if port.get('endPort'):
+            number += f"-{port['endPort']}"
+        described.append(f"{port.get('protocol', 'TCP')}/{number}")
+    return described
+
+
+def port_allowed(ports, port, protocol='TCP'):
+    """
+    Parameters:
+    ports: Ports as returned by describe_ports().
+    port: Port number or name.
+
+    Returns:
+    True if the port and protocol are within the described ports.
+    """
+    for described in ports:
+        if described == '*':
+            return True
+        rule_protocol, _, number = described.partition('/')
+        if rule_protocol.upper() != protocol.upper():
+            continue
+        first, _, last = number.partition('-')
+        if number == '*' or str(port) == first:
+            return True
+        if last and first.isdigit() and str(port).isdigit() and int(first) <= int(port) <= int(last):
+            return True
+    return False
+
+
+class LabelIndex():
+    """
+    Inverted index from labels to the ids of the objects carrying them.
+
+    Parameters:
+    table: LabelTable the label sets of the members were interned in.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.by_label = defaultdict(set) # label id -> ids
+        self.by_key = defaultdict(set) # key -> ids
+        self.members = set()
+
+    def add(self, member, labels):
+        """
+        Parameters:
+        labels: Frozenset of label ids from the table.
+        """
+        self.members.add(member)
+        for label_id in labels:
+            self.by_label[label_id].add(member)
+            self.by_key[self.table.key(label_id)].add(member)
+
+    def members_with(self, key, value):
+        label_id = self.table.ids.get((key, value))
+        return empty if label_id is None else self.by_label.get(label_id, empty)
+
+    def select(self, selector, within=None):
+        """
+        Find the members matching a Kubernetes label selector.
+
+        The sets for each term of the selector are intersected starting from the smallest, so the cost depends on
+        the size of the most specific term rather than on the number of members.
+
+        Parameters:
+        selector: Dictionary with optional matchLabels and matchExpressions. An empty selector matches everything.
+        within: Optional set of ids to limit the result to.
+
+        Returns:
+        Set of member ids. It may be the within set itself so it must not be modified.
+        """
+        universe = self.members if within is None else within
+        required = []
+        excluded = []
+        for key, value in (selector.get('matchLabels') or {}).items():
+            required.append(self.members_with(key, value))
+        for expression in selector.get('matchExpressions') or []:
+            key = expression.get('key')
+            operator = expression.get('operator')
+            values = expression.get('values') or []
+            if operator == 'In':
+                required.append(set().union(*(self.members_with(key, v) for v in values)))
+            elif operator == 'NotIn':
+                excluded.append(set().union(*(self.members_with(key, v) for v in values)))
+            elif operator == 'Exists':
+                required.append(self.by_key.get(key, empty))
+            elif operator == 'DoesNotExist':
+                excluded.append(self.by_key.get(key, empty))
+        if not required and not excluded:
+            return universe
+        if required:
+            required.append(universe)
+            required.sort(key=len)
+            result = set(required[0]).intersection(*required[1:])
+        else:
+            result = set(universe)
+        for members in excluded:
+            result.difference_update(members)
+        return result
+
+
+class NetworkPolicyEngine():
+    """
+    Evaluate Kubernetes NetworkPolicies against the pods they select.
+
+    Pods and namespaces are indexed by label once. Each policy's pod selector and each rule's peers are then resolved
+    against the indexes a single time and the resulting rule is attached to every pod the policy selects, so the
+    work is proportional to the number of pods plus the number of (policy, selected pod) pairs.
+
+    Parameters:
+    pods: kubernetes.pods
+    policies: kubernetes.firewall
+    namespaces: kubernetes.namespaces
+    """
+
+    def __init__(self, pods, policies, namespaces):
+        self.pods = pods
+        self.pod_index = LabelIndex(pods.labels)
+        self.namespace_pods = defaultdict(set)
+        for pod_id, pod in enumerate(pods):
+            self.pod_index.add(pod_id, pod.labels)
+            self.namespace_pods[pod.namespace].add(pod_id)
+        self.namespace_index = LabelIndex(namespaces.labels)
+        for namespace in namespaces:
+            self.namespace_index.add(namespace.name, namespace.labels)
+        for name in self.namespace_pods: # Pods may belong to namespaces that weren't listed
+            if name not in self.namespace_index.members:
+                self.namespace_index.add(name, empty)
+        self.all_pods = frozenset(range(len(pods)))
+        self.applied = {'ingress': defaultdict(list), 'egress': defaultdict(list)} # pod id -> Allowances
+        self.namespace_peer_pods = {} # namespace selector -> pod ids in the selected namespaces
+        for policy in policies:
+            self.apply_policy(policy)
+
+    def apply_policy(self, policy):
+        direction = policy.direction
+        allowances = [self.compile_rule(policy, rule) for rule in policy.rules]
+        targets = self.pod_index.select(policy.selector, self.namespace_pods.get(policy.namespace, empty))
+        for pod_id in targets:
+            # A pod selected by a policy without rules is still isolated, it just has nothing allowed by that policy
+            self.applied[direction][pod_id].extend(allowances)
+
+    def compile_rule(self, policy, rule):
+        """
+        Resolve the peers of one ingress or egress rule.
+
+        Returns:
+        Allowance
+        """
+        peers = []
+        for peer in rule.get('from' if policy.direction == 'ingress' else 'to') or []:
+            peers.append(self.compile_peer(policy, peer))
+        if not peers: # A rule without peers allows all sources or destinations
+            peers.append(Peer('*', self.all_pods, ipset.everywhere))
+        return Allowance(policy, peers, describe_ports(rule.get('ports')))
+
+    def compile_peer(self, policy, peer):
+        if 'ipBlock' in peer:
+            block = peer['ipBlock']
+            description = f"CIDR:{block.get('cidr')}"
+            if block.get('except'):
+                description += f" except {','.join(block['except'])}"
+            return Peer(description, None, ipset.ip_block(block['cidr'], block.get('except')))
+        pod_selector = peer.get('podSelector')
+        if 'namespaceSelector' in peer:
+            namespace_selector = peer['namespaceSelector'] or {}
+            description = f'NSLABEL:{describe_selector(namespace_selector)}'
+            namespaces = self.namespace_index.select(namespace_selector)
+            if pod_selector is not None:
+                # Select on the pod labels first, that set is usually far smaller than every pod in the namespaces
+                description += f' PODLABEL:{describe_selector(pod_selector)}'
+                pods = {pod_id for pod_id in self.pod_index.select(pod_selector) if self.pods[pod_id].namespace in namespaces}
+            else:
+                key = description
+                if key not in self.namespace_peer_pods: # Same selector in many policies, resolve it once
+                    self.namespace_peer_pods[key] = frozenset().union(*(self.namespace_pods.get(name, empty) for name in namespaces))
+                pods = self.namespace_peer_pods[key]
+        else:
+            within = self.namespace_pods.get(policy.namespace, empty)
+            description = f"NS:{policy.namespace}"
+            if pod_selector is not None:
+                description += f' PODLABEL:{describe_selector(pod_selector)}'
+                pods = self.pod_index.select(pod_selector, within)
+            else:
+                pods = within
+        return Peer(description, pods, None)
+
+    def is_isolated(self, pod_id, direction):
+        """
+        Returns:
+        True if any policy of the given direction selects the pod. Traffic to a pod that isn't isolated is allowed.
+        """
+        return pod_id in self.applied[direction]
+
+    def allowances(self, pod_id, direction):
+        """
+        Returns:
+        List of Allowances that apply to the pod, or None when the pod isn't isolated and everything is allowed.
+        """
+        return self.applied[direction].get(pod_id)
+
+    def allowed_pods(self, pod_id, direction):
+        """
+        Returns:
+        Set of pod ids allowed as sources (ingress) or destinations (egress) by the pod's own policies.
+        """
+        allowances = self.allowances(pod_id, direction)
+        if allowances is None:
+            return self.all_pods
+        return set().union(*(peer.pods for allowance in allowances for peer in allowance.peers if peer.pods))
+
+    def allowed_addresses(self, pod_id, direction, port=None, protocol='TCP'):
+        """
+        Parameters:
+        port: Only count rules allowing this port, any rule when None.
+
+        Returns:
+        IPSet of the addresses allowed as sources (ingress) or destinations (egress) by the pod's own policies.
+        """
+        allowances = self.allowances(pod_id, direction)
+        if allowances is None:
+            return ipset.everywhere
+        allowed = ipset.IPSet()
+        for allowance in allowances:
+            if port is None or port_allowed(allowance.ports, port, protocol):
+                for peer in allowance.peers:
+                    if peer.cidr is not None:
+                        allowed = allowed | peer.cidr
+        return allowed
+
+    def exposed_pods(self, network, port=None, protocol='TCP', direction='ingress'):
+        """
+        Find the pods whose policies allow every address of a network, e.g. "which pods accept 0.0.0.0/0 on 443".
+
+        Returns:
+        List of pod ids.
+        """
+        required = ipset.IPSet([network])
+        return [pod_id for pod_id in range(len(self.pods)) if not required - self.allowed_addresses(pod_id, direction, port, protocol)]
+
+    def allows(self, source_id, destination_id):
+        """
+        Returns:
+        True if both the source's egress and the destination's ingress policies allow traffic between two pods.
+        """
+        return (destination_id in self.allowed_pods(source_id, 'egress') and
+                source_id in self.allowed_pods(destination_id, 'ingress'))
+
+    def describe(self, pod_id, direction):
+        """
+        Returns:
+        List of the allowed peers of a pod as strings, ['*'] when the pod isn't isolated.
+        """
+        allowances = self.allowances(pod_id, direction)
+        if allowances is None:
+            return ['*']
+        described = []
+        for allowance in allowances:
+            policy = allowance.policy
+            for peer in allowance.peers:
+                count = f' ({len(peer.pods)} pods)' if peer.pods is not None else ''
+                described.append(f"{policy.namespace}/{policy.name}: {peer.description}{count} on {','.join(allowance.ports)}")
+        return described
@@ -0,0 +1,115 @@
+"""
+HTML and text reports rendered with Jinja2.
+
+Each control has its own template in audit_inspector/templates, <control>.html or <control>.txt, included by the
+report.html or report.txt layout. Controls without one use default.html or default.txt, which show the control's
+report columns. Compiled templates are kept in a bytecode cache on disk so later runs skip compiling them.
+
+The report is rendered with Template.generate() and written to the file as it is produced. Templates get the rows of
+each control a page at a time from a generator, so a report with a hundred thousand findings is never held in memory
+as one string, or as one list of rows.
+"""
+import itertools
+import os
+from datetime import datetime
+from pathlib import Path
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+from audit_inspector.common import settings
+
+template_dir = Path(__file__).resolve().parent.parent / 'templates'
+formats = {'.html': 'html', '.htm': 'html', '.txt': 'txt'}
+page_size = 1000 # Rows handed to a template at a time
+
+
+def split_note(note):
+    """
+    Returns:
+    (<KIND>, <TITLE>, <DETAIL>) of a 'FINDING$$<TITLE>$$<DETAIL>' or 'NOTE$$<TITLE>$$<DETAIL>' note.
+    """
+    parts = str(note).split('$$', 2)
+    if len(parts) == 1:
+        return '', parts[0], ''
+    return parts[0], parts[1], parts[2] if len(parts) > 2 else ''
+
+
+def get_environment(bytecode_dir=None):
+    """
+    Parameters:
+    bytecode_dir: Directory for the compiled templates, created if needed. Jinja2's directory under the system
+    temporary directory when None.
+
+    Returns:
+    The Environment loading templates from template_dir.
+    """
+    if bytecode_dir is not None:
+        Path(bytecode_dir).mkdir(parents=True, exist_ok=True)
+        bytecode_dir = str(bytecode_dir)
+    environment = Environment(
+        loader=FileSystemLoader(template_dir),
+        bytecode_cache=FileSystemBytecodeCache(bytecode_dir),
+        autoescape=select_autoescape(['html', 'htm']),
+        trim_blocks=True,
+        lstrip_blocks=True,
+        keep_trailing_newline=True,
+    )
+    environment.filters['split_note'] = split_note
+    return environment
+
+
+def pages(store, size=page_size):
+    """
+    Yield the rows of a ResultStore as lists of up to size rows.
+    """
+    rows = store.rows()
+    while True:
+        page = list(itertools.islice(rows, size))
+        if not page:
+            return
+        yield page
+
+
+def count_findings(store):
+    """
+    Returns:
+    Number of findings in the Notes of a ResultStore, counted on the encoded column without decoding the rows.
+    """
+    notes = store.columns.get('Notes')
+    if notes is None:
+        return 0
+    findings = [category.startswith('FINDING$$') for category in notes.items.categories]
+    return sum(1 for code in notes.items.codes if findings[code])
+
+
+def report_context(results, title):
+    return {
+        'title': title,
+        'generated': datetime.now(),
+        'controls': [{
+            'name': store.control,
+            'headers': settings.report_headers.get(store.control) or list(store.columns),
+            'rows': len(store),
+            'findings': count_findings(store),
+            'pages': pages(store),
+        } for store in results],
+    }
+
+
+def write_report(results, path, bytecode_dir=None, title='Audit Inspector Report'):
+    """
+    Render the results to an HTML or text report, chosen by the file suffix, HTML for any other suffix.
+
+    The report is written to a temporary file that replaces path once it is complete, so watch mode never leaves a
+    partial report behind.
+
+    Parameters:
+    results: ResultSet
+    path: Path of the report file.
+    bytecode_dir: Directory of the bytecode cache, see get_environment().
+    """
+    path = Path(path)
+    report_format = formats.get(path.suffix.lower(), 'html')
+    template = get_environment(bytecode_dir).get_template(f'report.{report_format}')
+    temporary = path.with_name(f'{path.name}.tmp')
+    with open(temporary, 'w', encoding='utf8') as f:
+        f.writelines(template.generate(report_context(results, title)))
+    os.replace(temporary, path)
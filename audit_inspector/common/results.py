@@ -0,0 +1,309 @@
+import json
+import sqlite3
+from array import array
+from audit_inspector.common import settings
+
+# Columns every control result carries in addition to its settings.report_headers.
+base_columns = ['Platform', 'Date']
+# Columns with few distinct values. Each value is stored once and rows hold an integer code.
+categorical_columns = {'Platform', 'Date', 'Protocol', 'Version', 'Cipher', 'Root Login', 'Namespace', 'Config Fingerprint'}
+# Columns holding lists. Their items are interned too since cipher names and findings repeat across hosts.
+list_columns = {'Available Ciphers', 'MACs', 'Key Exchange', 'Credential Methods', 'Notes', 'Ingress Sources', 'Egress Destinations'}
+
+
+class CategoricalColumn():
+    """
+    Dictionary encoded column: the distinct values and an array of integer codes, -1 for a missing value.
+    """
+
+    def __init__(self):
+        self.categories = []
+        self.codes_by_value = {}
+        self.codes = array('i')
+
+    def encode(self, value):
+        if value is None:
+            return -1
+        code = self.codes_by_value.get(value)
+        if code is None:
+            code = self.codes_by_value[value] = len(self.categories)
+            self.categories.append(value)
+        return code
+
+    def append(self, value):
+        self.codes.append(self.encode(value))
+
+    def __getitem__(self, row):
+        code = self.codes[row]
+        return None if code == -1 else self.categories[code]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def rows_equal(self, value):
+        code = self.codes_by_value.get(value)
+        if code is None:
+            return []
+        return [row for row, row_code in enumerate(self.codes) if row_code == code]
+
+    def groups(self):
+        grouped = {}
+        for row, code in enumerate(self.codes):
+            grouped.setdefault(code, []).append(row)
+        return {None if code == -1 else self.categories[code]: rows for code, rows in grouped.items()}
+
+
+class ListColumn():
+    """
+    Column of lists stored Arrow style: every item in one categorical column and an array of offsets into it.
+    """
+
+    def __init__(self):
+        self.items = CategoricalColumn()
+        self.offsets = array('q', [0])
+        self.missing = set() # Rows where the record had no value, as opposed to an empty list
+
+    def append(self, value):
+        if value is None:
+            self.missing.add(len(self))
+            value = []
+        elif isinstance(value, str):
+            value = [value]
+        for item in value:
+            self.items.append(item)
+        self.offsets.append(len(self.items))
+
+    def __getitem__(self, row):
+        if row in self.missing:
+            return None
+        return [self.items[i] for i in range(self.offsets[row], self.offsets[row + 1])]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def rows_containing(self, value):
+        code = self.items.codes_by_value.get(value)
+        if code is None:
+            return []
+        rows = []
+        row = 0
+        for position, item_code in enumerate(self.items.codes):
+            if item_code == code:
+                while self.offsets[row + 1] <= position:
+                    row += 1
+                if not rows or rows[-1] != row:
+                    rows.append(row)
+        return rows
+
+
+class ObjectColumn(list):
+    """
+    Plain column for values with many distinct values, e.g. hostnames.
+    """
+
+    def rows_equal(self, value):
+        return [row for row, row_value in enumerate(self) if row_value == value]
+
+    def groups(self):
+        grouped = {}
+        for row, value in enumerate(self):
+            grouped.setdefault(value, []).append(row)
+        return grouped
+
+
+def make_column(name):
+    if name in list_columns:
+        return ListColumn()
+    if name in categorical_columns:
+        return CategoricalColumn()
+    return ObjectColumn()
+
+
+class ResultStore():
+    """
+    Typed columnar store of the results of one control.
+
+    The columns follow settings.report_headers for the control. Repeated values such as the platform, protocol,
+    ciphers and findings are stored once, so memory grows with the number of distinct values rather than the number
+    of hosts.
+
+    Parameters:
+    columns: Column names, base_columns and the control's report headers when None.
+    add_columns: Add a column for every new field of the records appended, so they can be rebuilt by records().
+    """
+
+    def __init__(self, control, columns=None, add_columns=False):
+        self.control = control
+        if columns is None:
+            columns = base_columns + [c for c in settings.report_headers.get(control, []) if c not in base_columns]
+        self.columns = {name: make_column(name) for name in columns}
+        self.add_columns = add_columns
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, record):
+        if self.add_columns:
+            for name in record:
+                if name not in self.columns:
+                    self.add_column(name)
+        for name, column in self.columns.items():
+            column.append(record.get(name))
+        self.size += 1
+
+    def add_column(self, name):
+        column = self.columns[name] = make_column(name)
+        for _ in range(self.size): # Earlier rows don't have the field
+            column.append(None)
+
+    def row(self, index):
+        return {name: column[index] for name, column in self.columns.items()}
+
+    def rows(self, indexes=None):
+        """
+        Yield rows as dictionaries, all of them or just the given row indexes.
+        """
+        for index in range(self.size) if indexes is None else indexes:
+            yield self.row(index)
+
+    def records(self):
+        """
+        Yield the rows as the records they were appended as: fields without a value are left out.
+        """
+        for row in self.rows():
+            yield {name: value for name, value in row.items() if value is not None}
+
+    def column(self, name):
+        """
+        Returns:
+        List of the decoded values of a column.
+        """
+        column = self.columns[name]
+        return [column[row] for row in range(self.size)]
+
+    def where(self, name, value):
+        """
+        Returns:
+        Indexes of the rows where the column equals value, or for list columns contains value.
+        """
+        column = self.columns[name]
+        if isinstance(column, ListColumn):
+            return column.rows_containing(value)
+        return column.rows_equal(value)
+
+    def group_by(self, name):
+        """
+        Returns:
+        {<VALUE>: [<ROW INDEX>]} for a categorical or plain column.
+        """
+        return self.columns[name].groups()
+
+    def to_arrays(self):
+        """
+        Export the columns in an Arrow-like layout.
+
+        Returns:
+        {<COLUMN>: {'type': 'dictionary', 'codes', 'categories'} or {'type': 'list', 'offsets', 'codes',
+        'categories'} or {'type': 'object', 'values'}}
+        """
+        arrays = {}
+        for name, column in self.columns.items():
+            if isinstance(column, ListColumn):
+                arrays[name] = {'type': 'list', 'offsets': column.offsets, 'codes': column.items.codes, 'categories': column.items.categories}
+            elif isinstance(column, CategoricalColumn):
+                arrays[name] = {'type': 'dictionary', 'codes': column.codes, 'categories': column.categories}
+            else:
+                arrays[name] = {'type': 'object', 'values': column}
+        return arrays
+
+    def to_sqlite(self, connection):
+        """
+        Write the results to a table named after the control. List columns are stored as JSON arrays.
+
+        Parameters:
+        connection: sqlite3 connection.
+        """
+        names = list(self.columns)
+        quoted = ', '.join(f'"{name}"' for name in names)
+        connection.execute(f'DROP TABLE IF EXISTS "{self.control}"')
+        connection.execute(f'CREATE TABLE "{self.control}" ({quoted})')
+
+        def sql_rows():
+            for row in self.rows():
+                yield [json.dumps(row[name]) if name in list_columns and row[name] is not None else row[name] for name in names]
+        connection.executemany(f'INSERT INTO "{self.control}" VALUES ({", ".join("?" for _ in names)})', sql_rows())
+        connection.commit()
+
+
+class ResultSet():
+    """
+    The results of a run, one ResultStore per control.
+
+    Controls with a finalize step, such as merging records across evidence files, have their records held back until
+    finalize() is called once every file has been processed. They are held in a columnar ResultStore too, and handed
+    to the finalize step one at a time as they are decoded, so only the records it returns are ever all in memory as
+    dictionaries.
+
+    Parameters:
+    get_finalizer: Callable returning the finalize function of a control or None, e.g. ControlRegistry.finalizer.
+    compact_pending: Hold the records waiting for finalize() in a ResultStore. Watch mode keeps every file's records
+    anyway and its finalize steps recognize unchanged records by identity, so it holds the records themselves.
+    """
+
+    def __init__(self, get_finalizer=None, compact_pending=True):
+        self.stores = {}
+        self.get_finalizer = get_finalizer
+        self.compact_pending = compact_pending
+        self.finalizers = {} # control -> finalize function or None, looked up once per control
+        self.pending = {} # control -> ResultStore or list of the records waiting for finalize()
+
+    def __len__(self):
+        return sum(len(store) for store in self.stores.values())
+
+    def __iter__(self):
+        return iter(self.stores.values())
+
+    def __getitem__(self, control):
+        return self.stores[control]
+
+    def append(self, record):
+        control = record.get('Control', 'unknown')
+        if self.get_finalizer is not None:
+            if control not in self.finalizers:
+                self.finalizers[control] = self.get_finalizer(control)
+            if self.finalizers[control] is not None:
+                if control not in self.pending:
+                    self.pending[control] = ResultStore(control, [], add_columns=True) if self.compact_pending else []
+                self.pending[control].append(record)
+                return
+        self.store(control, record)
+
+    def store(self, control, record):
+        if control not in self.stores:
+            columns = None if control in settings.report_headers else list(record)
+            self.stores[control] = ResultStore(control, columns)
+        self.stores[control].append(record)
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def finalize(self):
+        """
+        Run the finalize step of each control over its held back records and store the records it returns.
+        """
+        pending, self.pending = self.pending, {}
+        for control, records in pending.items():
+            if isinstance(records, ResultStore):
+                records = records.records()
+            for record in self.finalizers[control](records):
+                self.store(record.get('Control', control), record)
+
+    def to_sqlite(self, path):
+        connection = sqlite3.connect(path)
+        try:
+            for store in self.stores.values():
+                store.to_sqlite(connection)
+        finally:
+            connection.close()
@@ -0,0 +1,62 @@
+missing = object()
+
+
+def compile_schema(fields):
+    """
+    Compile a projection schema.
+
+    A schema maps field names to dotted paths such as 'spec.containers.image'. When a path step lands on a list, the
+    remaining steps are applied to every element of the list and the results collected, the same way plucky's plucks()
+    does. Paths are compiled once into a tree of accessors that share common prefixes, so every field is pulled from
+    an entry in a single walk.
+
+    Parameters:
+    fields: Dictionary of {<FIELD_NAME>: <DOTTED_PATH>}.
+
+    Returns:
+    Function that takes an entry and returns {<FIELD_NAME>: <VALUE>}, with None for paths that aren't present.
+    """
+    root = {}
+    for name, path in fields.items():
+        node = root
+        keys = path.split('.')
+        for key in keys[:-1]:
+            node = node.setdefault(key, ({}, []))[0]
+        node.setdefault(keys[-1], ({}, []))[1].append(name)
+    walk = _compile_node(root)
+    names = tuple(fields)
+
+    def project(entry):
+        result = dict.fromkeys(names)
+        walk(entry, result)
+        return result
+    return project
+
+
+def _compile_node(node):
+    steps = tuple((key, _compile_node(children) if children else None, tuple(names)) for key, (children, names) in node.items())
+
+    def walk(value, result):
+        for key, walk_children, names in steps:
+            child = get_key(value, key)
+            if child is missing:
+                continue # Fields below here stay None
+            for name in names:
+                result[name] = child
+            if walk_children:
+                walk_children(child, result)
+    return walk
+
+
+def get_key(value, key):
+    """
+    Look up one path step.
+
+    Returns:
+    value[key] for a dictionary, the list of element[key] for each element of a list that has the key, or missing.
+    """
+    if isinstance(value, dict):
+        return value.get(key, missing)
+    if isinstance(value, list):
+        return [item[key] for item in value if isinstance(item, dict) and key in item]
+    return missing
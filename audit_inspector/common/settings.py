@@ -1,6 +1,5 @@
-import openpyxl
-from openpyxl.styles import Alignment, Border, Color, Font, PatternFill, Side
-
+# Evidence patterns of each control. A string or a list of strings must all be present in the evidence, a tuple holds
+# alternatives any one of which is enough. A control matched through several alternatives is still called once.
 control_categories = {
     'kubernetes': {
         'connection': 'openssl s_client',
@@ -8,59 +7,72 @@ control_categories = {
         'patching': '+ kubectl version'
     },
     'linux': {
-        'connection': 'MSG_SERVICE_ACCEPT',
+        'connection': ('MSG_SERVICE_ACCEPT', 'sshd -T'), # 'ssh -v' and 'sshd -T' output may be in separate files
         'firewall': 'iptables -l'
     }
 }
 
-insecure_ciphers = {
-    'ssh':
-        [
-        'arcfour',
-        'arcfour256',
-        'arcfour128'
-        ],
-    'tls':
-        [
-        'TLSv1'
-        ]
-    }
+# Cipher policy catalog, None for the bundled audit_inspector/policies/ciphers.json, and the profile checked against
+cipher_catalog = None
+cipher_profile = 'pci-minimum'
 
 report_headers = {
-    'connection': ['Hostname', 'Protocol', 'Version', 'Cipher', 'Available Ciphers', 'Credential Methods', 'Idle Timeout', 'Root Login', 'Notes']
+    'connection': ['Hostname', 'Protocol', 'Version', 'Cipher', 'Available Ciphers', 'MACs', 'Key Exchange', 'Credential Methods', 'Idle Timeout', 'Root Login', 'Config Fingerprint', 'Notes'],
+    'firewall': ['Hostname', 'Interface', 'Namespace', 'Ingress Sources', 'Egress Destinations', 'Notes']
+}
+
+# Controls whose report has a second sheet grouping the hosts by the value of a column
+report_groups = {
+    'connection': 'Config Fingerprint'
 }
 
 platforms = ['Kubernetes', 'Linux']
 
 
-# Excel formatting variables
-make_bold = Font(bold=True)
-make_italic = Font(italic=True)
-dark_green_fill = PatternFill(
-    start_color='03990f', end_color='03990f', fill_type='solid')
-light_gray_fill = PatternFill(
-    start_color='bcb7b9', end_color='bcb7b9', fill_type='solid')
-light_purple_fill = PatternFill(
-    start_color='d2a2f2', end_color='d2a2f2', fill_type='solid')
-light_green_fill = PatternFill(
-    start_color='8af202', end_color='8af202', fill_type='solid')
-light_pink_fill = PatternFill(
-    start_color='f7b2f2', end_color='f7b2f2', fill_type='solid')
-light_blue_fill = PatternFill(
-    start_color='02f2ee', end_color='02f2ee', fill_type='solid')
-light_orange_fill = PatternFill(
-    start_color='efc25f', end_color='efc25f', fill_type='solid')
-light_yellow_fill = PatternFill(
-    start_color='eff24d', end_color='eff24d', fill_type='solid')
-lime_green_fill = PatternFill(
-    start_color='ccffcc', end_color='ccffcc', fill_type='solid')
-bright_pink_fill = PatternFill(
-    start_color='ffccff', end_color='ffccff', fill_type='solid')
-bright_red_fill = PatternFill(
-    start_color='ff0000', end_color='ff0000', fill_type='solid')
-white_fill = PatternFill(
-    start_color='ffffff', end_color='ffffff', fill_type='solid')
-dark_blue_fill = PatternFill(
-    start_color='000066', end_color='000066', fill_type='solid')
-no_fill = openpyxl.styles.PatternFill(fill_type=None)
-header_font = Font(size=14, underline='single', color='ffffff', bold=True)
\ No newline at end of file
+# Excel formatting variables. They are built on first use, see __getattr__, so importing settings doesn't import openpyxl.
+excel_styles = ['make_bold', 'make_italic', 'dark_green_fill', 'light_gray_fill', 'light_purple_fill', 'light_green_fill',
+    'light_pink_fill', 'light_blue_fill', 'light_orange_fill', 'light_yellow_fill', 'lime_green_fill', 'bright_pink_fill',
+    'bright_red_fill', 'white_fill', 'dark_blue_fill', 'no_fill', 'header_font']
+
+
+def build_excel_styles():
+    from openpyxl.styles import Font, PatternFill
+
+    make_bold = Font(bold=True)
+    make_italic = Font(italic=True)
+    dark_green_fill = PatternFill(
+        start_color='03990f', end_color='03990f', fill_type='solid')
+    light_gray_fill = PatternFill(
+        start_color='bcb7b9', end_color='bcb7b9', fill_type='solid')
+    light_purple_fill = PatternFill(
+        start_color='d2a2f2', end_color='d2a2f2', fill_type='solid')
+    light_green_fill = PatternFill(
+        start_color='8af202', end_color='8af202', fill_type='solid')
+    light_pink_fill = PatternFill(
+        start_color='f7b2f2', end_color='f7b2f2', fill_type='solid')
+    light_blue_fill = PatternFill(
+        start_color='02f2ee', end_color='02f2ee', fill_type='solid')
+    light_orange_fill = PatternFill(
+        start_color='efc25f', end_color='efc25f', fill_type='solid')
+    light_yellow_fill = PatternFill(
+        start_color='eff24d', end_color='eff24d', fill_type='solid')
+    lime_green_fill = PatternFill(
+        start_color='ccffcc', end_color='ccffcc', fill_type='solid')
+    bright_pink_fill = PatternFill(
+        start_color='ffccff', end_color='ffccff', fill_type='solid')
+    bright_red_fill = PatternFill(
+        start_color='ff0000', end_color='ff0000', fill_type='solid')
+    white_fill = PatternFill(
+        start_color='ffffff', end_color='ffffff', fill_type='solid')
+    dark_blue_fill = PatternFill(
+        start_color='000066', end_color='000066', fill_type='solid')
+    no_fill = PatternFill(fill_type=None)
+    header_font = Font(size=14, underline='single', color='ffffff', bold=True)
+    return {name: value for name, value in locals().items() if name in excel_styles}
+
+
+def __getattr__(name):
+    if name in excel_styles:
+        globals().update(build_excel_styles())
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,233 @@
+"""
+Watch mode: keep the results of an evidence share up to date as files arrive.
+
+The evidence directories are polled for changes. Only files that were added or modified since the last poll are
+processed again, and deleted files have their results dropped. The results of every other file are kept in memory,
+and their parsed fields in the parse cache when one is configured, so a change costs the work of the changed file
+rather than a full run. After each change the result set is published to a JSON results file and/or served as JSON
+over HTTP.
+"""
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from audit_inspector.common import dispatch, evidence
+from audit_inspector.common.results import ResultSet
+
+
+class EvidenceWatcher():
+    """
+    Tracks the evidence files of some directories and the results of each.
+
+    Parameters:
+    evidence_dirs: Directories to watch.
+    list_paths: Callable returning the paths of the evidence files and archives of a directory, listed into their
+    members by evidence.list_archive().
+    process: Callable returning the results of a list of evidence files, one list of records per file.
+    """
+
+    def __init__(self, evidence_dirs, list_paths, process):
+        self.evidence_dirs = evidence_dirs
+        self.list_paths = list_paths
+        self.process = process
+        self.signatures = {} # path -> (modification time, size) when it was processed
+        self.file_results = {} # path -> list of the control function returns for the file
+        self.finalizers = {} # control -> finalize step kept between polls
+        self.updated = None
+        self.unreadable = set() # Paths that couldn't be listed on the last poll, reported once until they are readable
+
+    def scan(self):
+        """
+        An archive that can't be read, such as a zip still being copied into the share, keeps the signatures it had on
+        the last poll so its earlier results stay and it is listed again on the next poll.
+
+        Returns:
+        {<path>: (<modification time>, <size>)} for every evidence file now in the directories.
+        """
+        signatures = {}
+        unreadable = set()
+        for evidence_dir in self.evidence_dirs:
+            for path in self.list_paths(evidence_dir):
+                try:
+                    sources = evidence.list_archive(path)
+                    stat = os.stat(path) # Archive members change with their archive
+                except FileNotFoundError: # Deleted between listing and reading it
+                    continue
+                except evidence.archive_errors as e:
+                    if path not in self.unreadable:
+                        print(f'{datetime.now():%H:%M:%S} Unable to read {path}, retrying on the next poll: {e!r}', file=sys.stderr)
+                    unreadable.add(path)
+                    signatures.update((source, signature) for source, signature in self.signatures.items() if getattr(source, 'path', source) == path)
+                    continue
+                for source in sources:
+                    signatures[source] = (stat.st_mtime_ns, stat.st_size)
+        self.unreadable = unreadable
+        return signatures
+
+    def poll(self):
+        """
+        Process the files added or modified since the last poll and forget deleted ones.
+
+        Returns:
+        Tuple of the lists of added, modified and deleted paths.
+        """
+        signatures = self.scan()
+        added = [path for path in signatures if path not in self.signatures]
+        modified = [path for path in signatures if path in self.signatures and signatures[path] != self.signatures[path]]
+        deleted = [path for path in self.signatures if path not in signatures]
+        for path in deleted:
+            del self.signatures[path]
+            self.file_results.pop(path, None)
+        changed = added + modified
+        for path, test_results in zip(changed, self.process(changed)):
+            self.file_results[path] = test_results
+            self.signatures[path] = signatures[path]
+        if added or modified or deleted:
+            self.updated = datetime.now()
+        return added, modified, deleted
+
+    def results(self):
+        """
+        Returns:
+        ResultSet of every file's results, in file order and finalized as a full run would merge them. Controls with an
+        incremental finalize step only redo the work for the records of changed files.
+        """
+        results = ResultSet(self.finalizer, compact_pending=False) # The records are kept in file_results already
+        for path in sorted(self.file_results, key=str):
+            results.extend(self.file_results[path])
+        results.finalize()
+        return results
+
+    def finalizer(self, control):
+        if control not in self.finalizers:
+            self.finalizers[control] = dispatch.get_registry().incremental_finalizer(control)
+        return self.finalizers[control]
+
+
+def results_document(results, watcher):
+    """
+    Returns:
+    The published JSON document as bytes: update time, file count and the rows of each control.
+    """
+    document = {
+        'updated': watcher.updated.isoformat() if watcher.updated else None,
+        'files': len(watcher.file_results),
+        'results': {store.control: list(store.rows()) for store in results},
+    }
+    return json.dumps(document, default=str, indent=4).encode('utf8')
+
+
+def write_results_file(path, document):
+    """
+    Replace the results file in one step so readers never see a partial document.
+    """
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(document)
+    os.replace(temporary, path)
+
+
+class ResultsServer(ThreadingHTTPServer):
+    """
+    HTTP server publishing the latest results document. GET /results returns every control, /results/<control> one.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address):
+        super().__init__(address, ResultsRequestHandler)
+        self.document = b'{}'
+        self.controls = {}
+
+    def publish(self, document, controls):
+        # Replaced as a whole so request threads always see a complete document
+        self.document = document
+        self.controls = controls
+
+
+class ResultsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+        if path in ('', '/results'):
+            body = self.server.document
+        elif path.startswith('/results/') and path[len('/results/'):] in self.server.controls:
+            body = self.server.controls[path[len('/results/'):]]
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # Requests aren't worth a line on stderr each
+        pass
+
+
+def parse_address(serve):
+    """
+    Returns:
+    (host, port) from '<port>' or '<host>:<port>'. The host defaults to localhost.
+    """
+    host, _, port = serve.rpartition(':')
+    return (host or '127.0.0.1', int(port))
+
+
+def stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run(watcher, interval, results_file=None, serve=None, on_update=None, polls=None):
+    """
+    Poll the evidence until interrupted or terminated, publishing the results after each change.
+
+    Parameters:
+    watcher: EvidenceWatcher
+    interval: Seconds between polls.
+    results_file: Path of the JSON results file to keep up to date.
+    serve: '<port>' or '<host>:<port>' to serve the results on.
+    on_update: Callable taking the ResultSet, called after each change, e.g. to write the Excel report.
+    polls: Stop after this many polls, None to run until interrupted.
+
+    Returns:
+    The last ResultSet.
+    """
+    signal.signal(signal.SIGTERM, stop) # Stop cleanly when a service manager or container runtime stops the process
+    server = None
+    if serve:
+        server = ResultsServer(parse_address(serve))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f'Serving results on http://{server.server_address[0]}:{server.server_address[1]}/results', file=sys.stderr)
+    results = ResultSet()
+    count = 0
+    try:
+        while polls is None or count < polls:
+            if count:
+                time.sleep(interval)
+            count += 1
+            added, modified, deleted = watcher.poll()
+            if not (added or modified or deleted) and count > 1:
+                continue
+            results = watcher.results()
+            print(f'{datetime.now():%H:%M:%S} {len(added)} added, {len(modified)} modified, {len(deleted)} deleted, {len(results)} results', file=sys.stderr)
+            document = results_document(results, watcher)
+            if results_file:
+                write_results_file(results_file, document)
+            if server is not None:
+                controls = {store.control: json.dumps(list(store.rows()), default=str, indent=4).encode('utf8') for store in results}
+                server.publish(document, controls)
+            if on_update is not None:
+                on_update(results)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    return results
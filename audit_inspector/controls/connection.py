@@ -1,97 +1,236 @@
+from collections import namedtuple
 from audit_inspector.platforms import kubernetes as kube
 from audit_inspector.platforms import linux as lnx
-from audit_inspector.common import functions
-from audit_inspector.common import settings
-import re
+from audit_inspector.common import cache, ciphers, merge
 
 control = 'connection'
 
+# A registered check. protocols limits the check to records of those protocols, an empty set means every record. A
+# batch check takes a list of records and returns the finding of each.
+Rule = namedtuple('Rule', ['name', 'pci_controls', 'protocols', 'check', 'batch'])
+rules = []
+compiled_rules = {} # protocol -> tuple of the Rules that apply to it, built from rules on first use
+# Fields that identify a host rather than describe its configuration. Records that only differ in these are checked once.
+identity_fields = frozenset(['Hostname', 'Date', 'Notes'])
+
+
+def rule(pci_controls, protocols=(), batch=False):
+    """
+    Register a check function.
+
+    The check is called with the record and the PCI requirement ids joined for use in the finding text. It returns
+    the finding text or None. Checks must not depend on the identity_fields, a check's finding for one record is
+    copied to every record with the same configuration.
+
+    Parameters:
+    pci_controls: List of PCI requirement ids the check tests.
+    protocols: Protocols the check applies to, e.g. ['ssh']. Every protocol when empty.
+    batch: The check is called once with the list of records of a protocol and returns a list of findings instead.
+    """
+    def register(check):
+        rules.append(Rule(check.__name__, ', '.join(pci_controls), frozenset(p.lower() for p in protocols), check, batch))
+        compiled_rules.clear()
+        return check
+    return register
+
+
 def linux(text):
     """
-    Check Linux (Debian, RHEL) SSH configuration.
+    Collect the Linux (Debian, RHEL) SSH configuration of every host in the evidence. The checks run in finalize().
 
     Parameters:
-    text: 
-    
-    Output: <Platform>:<string>, <Hostname>:<string>, <Date>:<datetime>, <Protocol>:<string>, <Version>:<float>,
-    <Cipher>:<string>, <Available Ciphers>:<list>, <Credential Methods>:<list>, <Idle Timeout>:<int>, <Issues/Notes>:<list>}
+    text:
+
+    Output: [{<Platform>:<string>, <Hostname>:<string>, <Date>:<datetime>, <Protocol>:<string>, <Version>:<float>,
+    <Cipher>:<string>, <Available Ciphers>:<list>, <MACs>:<list>, <Key Exchange>:<list>, <Credential Methods>:<list>,
+    <Idle Timeout>:<int>, <Issues/Notes>:<list>}]
     """
-    l = lnx.linux(text) # Instantiate the linux class that processes the evidence
-    data = run_tests(l.connectionDetails)
-    data['Control'] = control
-    if checks(data) : data['Notes'] = checks(data) # This function calls all the specific check functions
-    return data
+    l = cache.parse(lnx.linux, text) # Instantiate the linux class that processes the evidence
+    return [label(record) for record in l.records]
 
 
 def kubernetes(text):
     """
-    Output: <Platform>:<string>, <Hostname>:<string>, <Date>:<datetime>, <Protocol>:<string>, <Version>:<float>,
-    <Cipher>:<string>, <Available Ciphers>:<list>, <Credential Methods>:<list>, <Idle Timeout>:<int>, <Issues/Notes>:<list>}
+    Collect the TLS configuration of every target tested with openssl s_client. The checks run in finalize().
+
+    Output: [{<Platform>:<string>, <Hostname>:<string>, <Date>:<datetime>, <Protocol>:<string>, <Version>:<float>,
+    <Cipher>:<string>, <Available Ciphers>:<list>, <Credential Methods>:<list>, <Idle Timeout>:<int>, <Issues/Notes>:<list>}]
     """
-    k = kube.kubernetes(text) # Instantiate the kubernetes class that processes the evidence
-    data = run_tests(k.connectionDetails)
-    data['Control'] = control
-    if checks(data) : data['Notes'] = checks(data) # This function calls all the specific check functions
-    return data
+    k = cache.parse(kube.kubernetes, text) # Instantiate the kubernetes class that processes the evidence
+    return [label(record) for record in k.connectionRecords]
+
 
-def run_tests(class_method):
-    data = class_method
+def label(data):
     data['Control'] = control
-    if checks(data) : data['Notes'] = checks(data) # This function calls all the specific check functions
     return data
 
 
-def checks(class_method):
-    data = class_method
-    data['Control'] = control
-    findings = []
-    if check_ssh_idle_timeout(data) : findings.append(check_ssh_idle_timeout(data))
-    if check_insecure_ciphers(data) : findings.append(check_insecure_ciphers(data))
-    if check_ssh_root_login(data) : findings.append(check_ssh_root_login(data))
-    return findings
-
-
-def check_ssh_idle_timeout(data): # Called by checks() function
-    pci_controls = ['8.1.8']
-    duration = ''
-    remediation = ''
-    text = f"FINDING$$Idle timeout is {duration}.$$PCI Requirement(s) {', '.join(pci_controls)} states that sessions idle for more than 15 minutes must require the user to re-authenticate to re-activate the terminal or session. This can be remediated by adjusting the clientaliveinterval (in seconds) and the clientalivecountmax (multiplier) to a combination equal to or less than 900."
-    
-    if 'ssh'.lower() == data['Protocol'].lower():
-        if data['Idle Timeout'] == 0:
-            duration = 'not configured'
-            return text
-        elif data['Idle Timeout'] > 900:
-            duration = 'greater than 15 minutes'
-            return text
-        
-
-def check_insecure_ciphers(data): # Called by checks() function
-    pci_controls = ['2.3.b', '8.2', '8.5']
-
-    for k,v in settings.insecure_ciphers.items():
-        if k.lower() in data['Protocol'].lower():
-            for cipher in v:
-                if (re.search(rf"{cipher}:", str(data['Available Ciphers']))) or (cipher in data['Available Ciphers']): 
-                    if 'ssh'.lower() == data['Protocol'].lower():
-                        return f"FINDING$$Weak SSH ciphers are enabled.$$PCI Requirement(s) {', '.join(pci_controls)} states that insecure remote-login commands not be available for remote access. RC4 encryption is steadily weakening in cryptographic strength and IETF document RFC4253 notes the deprecation of the RC4 ciphers. This can be remediated by explicitly denying weak ciphers 'Ciphers -arcfour*' in the SSHD configuration file."
-                    if 'tls'.lower() == data['Protocol'].lower():
-                        return f"FINDING$$TLS version 1.0 is enabled.$$PCI DSS states that after June 30, 2018, all entities must have stopped use of SSL/early TLS as a security control, and use only secure versions of the protocol."
-
-
-def check_ssh_root_login(data):
-    pci_controls = ['8.2', '8.5']
-    method = ''
-    credentialStore = ''
-    finding = f"FINDING$$Login as root is enabled using {method}.$$PCI Requirement(s) {', '.join(pci_controls)} prohibit generic or shared login accounts. Please provide evidence of how usage of the {credentialStore} for the root user can be traced back to an individual user."
-
-    if 'ssh'.lower() == data['Protocol'].lower():
-        if ('without-password' in data['Root Login']) or ('forced-commands-only' in data['Root Login']):
-            method = 'SSH keys'
-            credentialStore = 'SSH key'
-            return finding
-        if 'yes' in data['Root Login']:
-            method = 'a password'
-            credentialStore = 'password'
-            return finding
+def finalize(records):
+    """
+    Merge the records of each host across evidence files, then check them.
+
+    Called once with the records of every evidence file, so a host whose 'ssh -v' and 'sshd -T' output are in
+    different files is checked with both. See common/merge.py for which value wins when the files disagree.
+
+    Returns:
+    List of checked records, one per host.
+    """
+    merged = merge.merge_records(records)
+    check(merged)
+    return merged
+
 
+def check(merged):
+    for data, findings in zip(merged, evaluate_batch(merged)): # This function calls all the specific check functions
+        if findings : data['Notes'] = (data.get('Notes') or []) + findings
+
+
+class IncrementalFinalize():
+    """
+    finalize() for watch mode, which finalizes the records of every file again after each change.
+
+    The merged and checked record of each host is kept with the records it was built from. On the next call a host
+    whose records are the very same objects, because none of its files changed, reuses that record, so only the hosts
+    of changed files are merged and checked again.
+    """
+
+    def __init__(self):
+        self.hosts = {} # join key -> (the host's records, merged and checked record)
+
+    def __call__(self, records):
+        groups = {}
+        for record in records:
+            key = merge.join_key(record)
+            groups.setdefault(id(record) if key is None else key, []).append(record) # A record without a hostname is its own host
+        hosts = {}
+        changed = []
+        for key, group in groups.items():
+            cached = self.hosts.get(key)
+            if cached is not None and len(cached[0]) == len(group) and all(a is b for a, b in zip(cached[0], group)):
+                hosts[key] = cached
+            else:
+                changed.append(key)
+        merged = merge.merge_records(record for key in changed for record in groups[key]) # One record per key, in order
+        check(merged)
+        for key, record in zip(changed, merged):
+            hosts[key] = (groups[key], record)
+        self.hosts = hosts # Hosts no longer in the evidence are dropped
+        return [hosts[key][1] for key in groups]
+
+
+def incremental_finalizer():
+    return IncrementalFinalize()
+
+
+def rules_for(protocol):
+    """
+    Returns:
+    Tuple of the Rules that apply to a protocol, in registration order.
+    """
+    protocol = protocol.lower()
+    if protocol not in compiled_rules:
+        compiled_rules[protocol] = tuple(r for r in rules if not r.protocols or protocol in r.protocols)
+    return compiled_rules[protocol]
+
+
+def evaluation_key(data):
+    """
+    Returns:
+    Hashable form of the fields of a record the checks look at. Hosts built from the same image have the same key.
+    """
+    return tuple(sorted((field, tuple(value) if isinstance(value, list) else value) for field, value in data.items() if field not in identity_fields))
+
+
+def evaluate_batch(records):
+    """
+    Run the checks against many connection records.
+
+    Records with the same configuration, e.g. every host built from one image, are checked once and share the
+    findings. The unique records are grouped by protocol so the applicable rules are looked up once per protocol, then
+    each rule runs once per record, or once per protocol for batch rules.
+
+    Parameters:
+    records: List of connection records, e.g. connectionDetails from the platform classes.
+
+    Returns:
+    List with the findings of each record, in the same order as records.
+    """
+    unique = {} # evaluation key -> index in representatives
+    representatives = []
+    positions = []
+    for data in records:
+        key = evaluation_key(data)
+        if key not in unique:
+            unique[key] = len(representatives)
+            representatives.append(data)
+        positions.append(unique[key])
+    findings = [[] for _ in representatives]
+    by_protocol = {}
+    for i, data in enumerate(representatives):
+        by_protocol.setdefault(data.get('Protocol', '').lower(), []).append(i)
+    for protocol, indexes in by_protocol.items():
+        for r in rules_for(protocol):
+            if r.batch:
+                checked = zip(indexes, r.check([representatives[i] for i in indexes], r.pci_controls))
+            else:
+                checked = ((i, r.check(representatives[i], r.pci_controls)) for i in indexes)
+            for i, finding in checked:
+                if finding : findings[i].append(finding)
+    return [list(findings[position]) for position in positions]
+
+
+@rule(['8.1.8'], protocols=['ssh'])
+def check_ssh_idle_timeout(data, pci_controls):
+    if 'Idle Timeout' not in data: # sshd -T output wasn't provided
+        return None
+    if data['Idle Timeout'] == 0:
+        duration = 'not configured'
+    elif data['Idle Timeout'] > 900:
+        duration = 'greater than 15 minutes'
+    else:
+        return None
+    return f"FINDING$$Idle timeout is {duration}.$$PCI Requirement(s) {pci_controls} states that sessions idle for more than 15 minutes must require the user to re-authenticate to re-activate the terminal or session. This can be remediated by adjusting the clientaliveinterval (in seconds) and the clientalivecountmax (multiplier) to a combination equal to or less than 900."
+
+
+# Why weak algorithms matter for each protocol, in the finding text
+weak_algorithm_requirements = {
+    'ssh': 'states that insecure remote-login commands not be available for remote access and that strong cryptography be used.',
+    'tls': 'states that only strong cryptography and security protocols be used. SSL and early TLS are not considered strong cryptography since June 30, 2018.',
+}
+
+
+@rule(['2.3.b', '8.2', '8.5'], protocols=['ssh', 'tls'], batch=True)
+def check_insecure_ciphers(records, pci_controls):
+    """
+    Classify the algorithms of every record against the configured cipher policy, see common/ciphers.py. Each record
+    gets one finding listing every weak item it offers.
+    """
+    policy = ciphers.get_policy()
+    return [weak_algorithm_finding(data, weak, policy, pci_controls) for data, weak in zip(records, policy.classify_batch(records))]
+
+
+def weak_algorithm_finding(data, weak, policy, pci_controls):
+    if not weak:
+        return None
+    protocol = data.get('Protocol', '').lower()
+    by_category = {}
+    for weakness in weak:
+        by_category.setdefault(weakness.category, []).append(f'{weakness.name} ({weakness.reason})')
+    titles = [policy.titles.get(category, {}).get('title', category) for category in by_category]
+    listed = ' '.join(f"{title}: {', '.join(items)}." for title, items in zip(titles, by_category.values()))
+    remediation = ' '.join(policy.titles.get(category, {}).get('remediation', '') for category in by_category).strip()
+    return f"FINDING$$Weak {', '.join(titles)} are enabled.$$The {policy.name} cipher policy flags {listed} PCI Requirement(s) {pci_controls} {weak_algorithm_requirements[protocol]} {remediation}"
+
+
+@rule(['8.2', '8.5'], protocols=['ssh'])
+def check_ssh_root_login(data, pci_controls):
+    root_login = data.get('Root Login', '')
+    if ('without-password' in root_login) or ('forced-commands-only' in root_login):
+        method = 'SSH keys'
+        credentialStore = 'SSH key'
+    elif 'yes' in root_login:
+        method = 'a password'
+        credentialStore = 'password'
+    else:
+        return None
+    return f"FINDING$$Login as root is enabled using {method}.$$PCI Requirement(s) {pci_controls} prohibit generic or shared login accounts. Please provide evidence of how usage of the {credentialStore} for the root user can be traced back to an individual user."
@@ -1,48 +1,54 @@
 from audit_inspector.platforms import kubernetes as kube
-from audit_inspector.common.functions import traverse
-#from audit_inspector.common.checks import pci_1_1_4
+from audit_inspector.common import cache, ipset, reachability
+
+control = 'firewall'
 
 def kubernetes(text):
-    k = kube.kubernetes(text) # Instantiate the kubernetes class that processes the evidence
     """
-    TODO figure out how I can create a central testing file. This will likely include making standard variable names
-    that are consistent across platforms so I can pass them into the central function. So determine the variable in
-    each platform file and pass those consistent variables into the check.
-    Here is the common outputs I'm working towards:
-    {<Interface>: {<Direction>:, <Source/Destination>:, <Ports>:}
+    Evaluate Kubernetes network policies for every pod.
+
+    The pod is the interface in Kubernetes so there is one result per pod listing what the network policies allow it
+    to receive traffic from and send traffic to.
+
+    Output: [{<Platform>:<string>, <Hostname>:<string>, <Date>:<datetime>, <Interface>:<string>, <Namespace>:<string>,
+    <Ingress Sources>:<list>, <Egress Destinations>:<list>, <Notes>:<list>}]
     """
-    pass
-    '''
-    interface= []
-    for podInfo in k.pods:
-        d = {'interface':podInfo['name']} # Pod is the interface in K8s so always to list out all pods
-        for netpolInfo in k.firewall: # Check network policies 
-            for podLabel in podInfo['labels']:
-                for netpolLabel in netpolInfo['interface']:
-                    if 'L:' in netpolLabel:
-                        if podLabel in netpolLabel:
-                            d['direction'] = 'inbound'
-                    elif 'N:' in netpolLabel:
-                        if podInfo['namespace'] in netpolLabel:
-                            d['direction'] = 'inbound'
-                if 'ingress_from' in netpolInfo:
-                    for ingress in netpolInfo['ingress_from']:
-                        if ingress.split(':')[0] in podLabel:
-                            d['source'] = podInfo['name']
-                        elif '!' == ingress:
-                            d['source'] = '!'
-                        else:
-                            d['source'] = ingress
-                if 'egress_to' in netpolInfo:
-                    for egress in netpolInfo['egress_to']:
-                        if egress.split(':')[0] in podLabel:
-                            d['destination'] = podInfo['name']
-                        elif '!' == egress:
-                            d['destination'] = '!'
-                        else:
-                            d['destination'] = egress
-        interface.append(d)
-
-    for i in interface:
-        print(i)
-    '''
\ No newline at end of file
+    k = cache.parse(kube.kubernetes, text) # Instantiate the kubernetes class that processes the evidence
+    engine = reachability.NetworkPolicyEngine(k.pods, k.firewall, k.namespaces)
+    results = []
+    for pod_id, pod in enumerate(engine.pods):
+        data = {}
+        data['Platform'] = 'Kubernetes'
+        data['Hostname'] = k.hostname
+        data['Date'] = k.date
+        data['Control'] = control
+        data['Interface'] = pod.name
+        data['Namespace'] = pod.namespace
+        data['Ingress Sources'] = engine.describe(pod_id, 'ingress')
+        data['Egress Destinations'] = engine.describe(pod_id, 'egress')
+        findings = checks(engine, pod_id, data)
+        if findings : data['Notes'] = findings
+        results.append(data)
+    return results
+
+
+def checks(engine, pod_id, data):
+    findings = []
+    for check in (check_pod_isolation, check_unrestricted_ingress):
+        finding = check(engine, pod_id, data)
+        if finding : findings.append(finding)
+    return findings
+
+
+def check_pod_isolation(engine, pod_id, data): # Called by checks() function
+    pci_controls = ['1.2.1', '1.3']
+    if not engine.is_isolated(pod_id, 'ingress'):
+        return f"FINDING$$Pod {data['Interface']} in namespace {data['Namespace']} is not selected by any ingress network policy.$$PCI Requirement(s) {', '.join(pci_controls)} states that inbound traffic must be restricted to that which is necessary. Without a network policy selecting the pod, Kubernetes allows traffic from every pod and address. This can be remediated by adding a default deny network policy to the namespace and allowing only required traffic."
+
+
+def check_unrestricted_ingress(engine, pod_id, data): # Called by checks() function
+    pci_controls = ['1.2.1', '1.3']
+    for allowance in engine.allowances(pod_id, 'ingress') or []:
+        for peer in allowance.peers:
+            if peer.cidr is not None and any(not public - peer.cidr for public in (ipset.internet, ipset.internet6)): # Every public IPv4 or IPv6 address is allowed
+                return f"FINDING$$Network policy {allowance.policy.name} allows inbound traffic to pod {data['Interface']} from any internet address on {', '.join(allowance.ports)}.$$PCI Requirement(s) {', '.join(pci_controls)} states that inbound traffic must be restricted to that which is necessary. Please provide the business justification for allowing traffic from the internet or restrict the policy to the required sources."
@@ -1,267 +1,264 @@
-from collections import defaultdict
-import json
-import itertools
-import re
-from plucky import pluck, plucks, pluckable, merge # TODO remove the specific imports not needed
+import sys
+from functools import cached_property
 from audit_inspector.common import functions
-from dateutil import parser
-import simplejson as json
-import ipaddress
-from collections import abc
+from audit_inspector.common.reachability import LabelTable
+from audit_inspector.common.cache import cached_field
+from audit_inspector.common.schema import compile_schema
+
+# Fields pulled from each Kubernetes object. Each schema is compiled once and extracts all of its fields in one walk.
+pod_schema = compile_schema({
+    'name': 'metadata.name',
+    'namespace': 'metadata.namespace',
+    'labels': 'metadata.labels',
+    'image': 'spec.containers.image',
+    'limits': 'spec.containers.resources.limits',
+})
+network_policy_schema = compile_schema({
+    'name': 'metadata.name',
+    'namespace': 'metadata.namespace',
+    'policy_types': 'spec.policyTypes',
+    'pod_selector': 'spec.podSelector',
+    'ingress': 'spec.ingress',
+    'egress': 'spec.egress',
+})
+service_schema = compile_schema({
+    'name': 'metadata.name',
+    'namespace': 'metadata.namespace',
+    'type': 'spec.type',
+    'selector': 'spec.selector',
+    'ip': 'status.loadBalancer.ingress.ip',
+    'ports': 'spec.ports.port',
+})
+namespace_schema = compile_schema({
+    'name': 'metadata.name',
+    'labels': 'metadata.labels',
+})
+
+
+def intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Records(list):
+    """
+    List of Kubernetes object records whose label sets are ids in the same LabelTable.
+    """
+
+    __slots__ = ('labels',)
+
+    def __init__(self, records=()):
+        super().__init__(records)
+        self.labels = LabelTable()
+
+
+# Kubernetes objects as slotted records. A snapshot holds hundreds of thousands of pods, a dict each with its own
+# copies of the label and namespace strings costs several times the memory. Names that repeat across objects, such as
+# namespaces and images, are interned and labels are frozensets of ids in the LabelTable of their Records.
+class Pod():
+    __slots__ = ('name', 'namespace', 'labels', 'image', 'limits')
+
+    def __init__(self, name, namespace, labels, image, limits):
+        self.name = name
+        self.namespace = namespace
+        self.labels = labels
+        self.image = image
+        self.limits = limits
+
+
+class NetworkPolicy():
+    """
+    One direction of a NetworkPolicy. selector and rules are the pod selector and rules as written in the policy, the
+    reachability engine resolves their peers and ports once for every pod the policy selects.
+    """
+
+    __slots__ = ('name', 'namespace', 'direction', 'selector', 'rules')
+
+    def __init__(self, name, namespace, direction, selector, rules):
+        self.name = name
+        self.namespace = namespace
+        self.direction = direction
+        self.selector = selector
+        self.rules = rules
+
+
+class Service():
+    __slots__ = ('name', 'namespace', 'type', 'labels', 'ip', 'ports')
+
+    def __init__(self, name, namespace, type, labels, ip, ports):
+        self.name = name
+        self.namespace = namespace
+        self.type = type
+        self.labels = labels
+        self.ip = ip
+        self.ports = ports
+
+
+class Namespace():
+    __slots__ = ('name', 'labels')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
 
 
 class kubernetes():
+    """
+    Kubernetes evidence.
+
+    Sections are indexed when the object is created but none are parsed until the attribute that needs them is used,
+    so a control that only reads connectionDetails never decodes the pod list.
+    """
+
+    parser_version = 9 # Increase when parsing changes so cached results are discarded
+    platform = 'Kubernetes'
 
     def __init__(self, text):
+        self.text = text
 
-        # TEXT PROCESSING VARIABLES
-        ###############################################################################################################
-        section_regxp = re.compile(r'(?<=\+\s)?(?P<command>.*)\n(?P<output>[\s\S]*?)\+\s')
-        command_regx = re.search(section_regxp, text).group('command')
-        output_regx = re.search(section_regxp, text).group('output').replace('\n\n', '\n')
-        ###############################################################################################################
+    @cached_property
+    def sections(self):
+        return functions.index_sections(self.text)
 
-        # EVIDENCE VARIABLES
-        ###############################################################################################################
+    def find_sections(self, keyword):
+        """
+        Returns:
+        SectionSpans of the sections whose command contains keyword.
+        """
+        return [span for span in self.sections if keyword in span.command]
+
+    def json_entries(self, keyword):
+        """
+        Stream the Kubernetes objects from the last section whose command contains keyword.
+        """
+        spans = self.find_sections(keyword)
+        if spans:
+            yield from functions.section_text_to_json(functions.iter_section_chunks(self.text, spans[-1]))
+
+    @cached_field
+    def date(self):
         date = '' # This needs to be included with any information returned by the class
+        for span in self.find_sections('date'):
+            date = functions.get_evidence_date(functions.read_section(self.text, span).output)
+        return date
+
+    @cached_field
+    def hostname(self):
         hostname = '' # Not all Kube output will include 'config view' so there are multiple methods to find hostname
-        platform = 'Kubernetes'
-        connectionDetails = {}
-        connectionDetails['Available Ciphers'] = []
-        ###############################################################################################################
-        for section in re.finditer(section_regxp, text):
-            if 'date' in section.group('command'):
-                date = functions.get_evidence_date(section.group('output'))
-
-            if 'config view' in section.group('command'):
-                for line in section.group('output').split('\n'):
-                    if 'server:' in line:
-                        hostname = line.split()[1]
-
-            if 'get pods' in section.group('command'):
-                def get_pod_info():
-                    """
-                    Collect and return Kubernetes pod information as a list of dictionaries with the following information:
-                    {<POD_NAME>:, <NAMESPACE>:, <LABELS>:} Likely to add <IMAGE>:, <RESOURCE_LIMITS>:
-                    Kubernetes returns a very complicated json object with nested dictionaries, lists, etc. So Plucky
-                    is used to simplify data retrieval.
-                    """
-                    pod_info = []
-                    for entry in functions.section_text_to_json(section):
-                        d = {}
-                        # <POD_NAME>
-                        d['name'] = plucks(entry, 'metadata.name')
-                        # <NAMESPACE>
-                        d['namespace'] = plucks(entry, 'metadata.namespace')
-                        # <LABELS>
-                        labels = []
-                        if plucks(entry, 'metadata.labels'):
-                            for label in functions.traverse(plucks(entry, 'metadata.labels')):
-                                labels.append(f"{label[0]}={label[1]}")
-                        else:
-                            labels.append('!')
-                        d['labels'] = labels
-                        # <IMAGE>
-                        d['image'] = plucks(entry, 'spec.containers.image')
-                        # <RESOURCE_LIMITS>
-                        limits = []
-                        if plucks(entry, 'spec.containers.resources.limits'):
-                            for limit in plucks(entry, 'spec.containers.resources.limits'):
-                                for k,v in limit.items():
-                                    limits.append(f'{k}={v}')
-                        else:
-                            limits = '*:*'
-                        d['limits'] = limits
-                        pod_info.append(d)
-                    return pod_info
-
-                self.pods = get_pod_info()
-
-            if 'get networkpolicy' in section.group('command'):
-                def getFirewallInfo():
-                    """
-                    Collect and return Kubernetes Network Policy object information as a list of dictionaries.
-
-                    Inputs: kubectl get networkpolicy -A -o json
-
-                    Returns: {<NAME>:, <NAMESPACE>:, <ACTION>:, <SOURCE>:, <DEST>:, <PROTOCOL>:, <PORT>}
-                    """
-                    firewall_rules = [] # list to hold dictionaries of test results
-                    for entry in functions.section_text_to_json(section):
-                        # TODO figure out how to level this so I can use a common function in each if/else block
-                        # If spec.ingress exists then the pod selector is the destination and the spec.ingress is the source
-                        def build_acl_dict(entry, action, direction):
-                            results = {}
-
-                            # <ACL_NAME>
-                            results.update({'name': plucks(entry, 'metadata.name')})
-                            # <NAMESPACE>
-                            results.update({'namespace': plucks(entry, 'metadata.namespace')})
-                            # <ACTION>
-                            results.update({'action': action})
-                            # <PORTS>
-                            ports = []
-                            protocols = []
-                            if plucks(entry, f"spec.{direction}.ports"):
-                                for i in functions.traverse(plucks(entry, f"spec.{direction}.ports")):
-                                    if 'protocol' in i:
-                                        protocols.append(f"{i[1]}")
-                                    if 'port' in i:
-                                        ports.append(f"{i[1]}")
-                            if ports:
-                                results.update({'ports': ports})
-                                results.update({'protocols': protocols})
-                            if not ports:
-                                results.update({'ports': '*'})
-                                results.update({'protocols': '*'})
-                            # <SOURCE>
-                            if direction == 'ingress':
-                                results.update({'source': k8s_selectors(plucks(entry, 'spec.ingress.from'))})
-                                # <DESTINATION>
-                                if plucks(entry, 'spec.podSelector'): # an empty pod selector allows all in the NS
-                                    results.update({'destination': k8s_selectors(plucks(entry, 'spec.podSelector'))})
-                                else:
-                                    results.update({'destination': '*'})
-                            if direction == 'egress':
-                                # <SOURCE>
-                                if plucks(entry, 'spec.podSelector'): # an empty pod selector allows all in the NS
-                                    results.update({'source': k8s_selectors(plucks(entry, 'spec.podSelector'))})
-                                else:
-                                    results.update({'source': '*'})
-                                # <DESTINATION>
-                                results.update({'destination': k8s_selectors(plucks(entry, 'spec.egress.to'))})
-                            return results
-
-                        if 'Ingress' in plucks(entry, 'spec.policyTypes'):
-                            if plucks(entry, 'spec.ingress'): # allow
-                                firewall_rules.append(build_acl_dict(entry, 'allow', 'ingress'))
-                            else: # If spec.ingress is missing then no traffic is allowed to the podSelector target
-                                firewall_rules.append(build_acl_dict(entry, 'deny', 'ingress'))
-
-                        # If spec.egress exists then the pod selector is the source and the spec.egress is the destination
-                        if 'Egress' in plucks(entry, 'spec.policyTypes'):
-                            if plucks(entry, 'spec.egress'): # allow
-                                firewall_rules.append(build_acl_dict(entry, 'allow', 'egress'))
-                            else: # empty or missing egress target blocks all egress traffic
-                                firewall_rules.append(build_acl_dict(entry, 'deny', 'egress'))
-                    return firewall_rules
-
-                self.firewall = getFirewallInfo()
-
-            if 'get service' in section.group('command'):
-                def get_services():
-                    """
-                    Collect and return Kubernetes Service object information as a nested dictionary with the
-                    following information:
-                    {<SERVICE NAME>: {<NAMESPACE>, <TYPE>, <LABELS>, <IP>, <PORTS>}}
-                    Kubernetes returns a very complicated json object with nested dictionaries, lists, etc. So Plucky
-                    is used to simplify data retrieval.
-                    """
-                    # TODO the service info hasnt been vetted very well. go through and make sure its grabbing everything
-
-                    service_info = defaultdict(dict)
-                    for entry in functions.section_text_to_json(section):
-                        service_name = plucks(entry, 'metadata.name')
-                        # <NAMESPACE>
-                        service_info[service_name]['namespace'] = plucks(entry, 'metadata.namespace')
-                        # <TYPE>
-                        service_info[service_name]['type'] = plucks(entry, 'spec.type')
-                        # <LABELS>
-                        labels = []
-                        if plucks(entry, 'spec.selector'):
-                            for label in functions.traverse(plucks(entry, 'spec.selector')):
-                                labels.append(f"{label[0]}={label[1]}")
-                        else:
-                            labels.append('!*=!*')
-                        service_info[service_name]['labels'] = labels
-                        # <IP>
-                        if plucks(entry, 'status.loadBalancer.ingress.ip'):
-                            service_info[service_name]['ip'] = ''.join(plucks(entry, 'status.loadBalancer.ingress.ip'))
-                        # <PORTS>
-                        if str(plucks(entry, 'spec.ports.port')):
-                            service_info[service_name]['ports'] = ''.join(str(plucks(entry, 'spec.ports.port')))
-                    return service_info
-                self.services = get_services()
-
-            if 'get namespace' in section.group('command'):
-                def get_namespaces():
-                    """
-                    Collect and return Kubernetes Namespace object information as a nested dictionary with the
-                    following information:
-                    {<NAMESPACE_NAME>: {<LABELS>;,}}
-                    Kubernetes returns a very complicated json object with nested dictionaries, lists, etc. So Plucky
-                    is used to simplify data retrieval.
-                    """
-                    namespace_info = defaultdict(dict)
-                    for entry in functions.section_text_to_json(section):
-                        namespace_name = plucks(entry, 'metadata.name')
-                        # <LABELS>
-                        labels = []
-                        if plucks(entry, 'metadata.labels'):
-                            for label in functions.traverse(plucks(entry, 'metadata.labels')):
-                                labels.append(f"{label[0]}={label[1]}")
-                        else:
-                            labels.append('!*=!*')
-                        namespace_info[namespace_name]['labels'] = labels
-                    return namespace_info
-                self.namespaces = get_namespaces()
-
-            # Process OpenSSL s_client output
-            ###############################################################################################################
-            if 'openssl s_client' in section.group('command'):
-                connectionDetails.update(functions.process_openssl_output(connectionDetails, platform, date, section.group('output'), section.group('command')))
-        self.connectionDetails = connectionDetails
-
-def k8s_selectors(json):
-    """
-    Options for ingresses include CIDR/except, labels, and namespace. This function checks for all
-    of those and returns the results.
+        for span in self.find_sections('config view'):
+            for line in functions.read_section(self.text, span).output.split('\n'):
+                if 'server:' in line:
+                    hostname = line.split()[1]
+        return hostname
 
-    Returns: List of the results with possible formats CIDR:<value>, LABEL:<value>, NAMESPACE:<value>
-    """
-    # TODO figure out how to fold this into functions.traverse. Need a way to notate whether its a namespace Selector, podselector, cidr, etc.
-    selectors = [] # there may be multiple ingress options so hold them here
-    if json:
-        # The JSON is usually a nested dict in a list so this section iterates through that to get to the data.
-        ###############################################################################################################
-        if isinstance(json, list):
-            for item in itertools.chain.from_iterable(json):
-                if isinstance(item, dict):
-                    for key in item:
+    @cached_field
+    def pods(self):
+        """
+        Collect and return Kubernetes pod information as Records of Pods with the following information:
+        <POD_NAME>, <NAMESPACE>, <LABELS>, <IMAGE>, <RESOURCE_LIMITS>
+        Kubernetes returns a very complicated json object with nested dictionaries, lists, etc. So
+        pod_schema is used to simplify data retrieval.
+        """
+        pod_info = Records()
+        shared = {} # Image and limit tuples repeat for every replica, keep one of each
+        for entry in self.json_entries('get pods'):
+            fields = pod_schema(entry)
+            # <LABELS>
+            labels = pod_info.labels.label_set(functions.traverse(fields['labels']) if fields['labels'] else ())
+            # <IMAGE>
+            image = tuple(intern(i) for i in fields['image'] or ())
+            image = shared.setdefault(image, image)
+            # <RESOURCE_LIMITS>
+            limits = []
+            if fields['limits']:
+                for limit in fields['limits']:
+                    for k,v in limit.items():
+                        limits.append(sys.intern(f'{k}={v}'))
+                limits = tuple(limits)
+                limits = shared.setdefault(limits, limits)
+            else:
+                limits = '*:*'
+            pod_info.append(Pod(fields['name'], intern(fields['namespace']), labels, image, limits))
+        return pod_info
+
+    @cached_field
+    def firewall(self):
+        """
+        Collect and return Kubernetes Network Policy object information as a list of NetworkPolicy records, one per
+        direction of each policy.
+
+        Inputs: kubectl get networkpolicy -A -o json
+
+        Returns: [NetworkPolicy(<NAME>, <NAMESPACE>, <DIRECTION>, <POD SELECTOR>, <RULES>)]
+        """
+        firewall_rules = [] # list to hold the policy records
+        for entry in self.json_entries('get networkpolicy'):
+            fields = network_policy_schema(entry)
+            policy_types = fields['policy_types']
+            if not policy_types: # Kubernetes defaults to Ingress, plus Egress if there are egress rules
+                policy_types = ['Ingress', 'Egress'] if fields['egress'] else ['Ingress']
+            for direction in ('ingress', 'egress'):
+                if direction.capitalize() in policy_types:
+                    # A direction without rules allows no traffic to or from the pods the policy selects
+                    firewall_rules.append(NetworkPolicy(fields['name'], intern(fields['namespace']), direction,
+                                                        fields['pod_selector'] or {}, fields[direction] or []))
+        return firewall_rules
+
+    @cached_field
+    def services(self):
+        """
+        Collect and return Kubernetes Service object information as Records of Services with the
+        following information:
+        <SERVICE NAME>, <NAMESPACE>, <TYPE>, <LABELS>, <IP>, <PORTS>
+        Kubernetes returns a very complicated json object with nested dictionaries, lists, etc. So
+        service_schema is used to simplify data retrieval.
+        """
+        # TODO the service info hasnt been vetted very well. go through and make sure its grabbing everything
+
+        service_info = Records()
+        for entry in self.json_entries('get service'):
+            fields = service_schema(entry)
+            # <LABELS> from the selector, the pods the service sends traffic to
+            labels = service_info.labels.label_set(functions.traverse(fields['selector']) if fields['selector'] else ())
+            # <IP>
+            ip = ''.join(fields['ip']) if fields['ip'] else None
+            # <PORTS>
+            service_info.append(Service(fields['name'], intern(fields['namespace']), intern(fields['type']), labels, ip, str(fields['ports'])))
+        return service_info
+
+    @cached_field
+    def namespaces(self):
+        """
+        Collect and return Kubernetes Namespace object information as Records of Namespaces with their
+        <NAMESPACE_NAME> and <LABELS>.
+        Kubernetes returns a very complicated json object with nested dictionaries, lists, etc. So
+        namespace_schema is used to simplify data retrieval.
+        """
+        namespace_info = Records()
+        for entry in self.json_entries('get namespace'):
+            fields = namespace_schema(entry)
+            # <LABELS>
+            labels = namespace_info.labels.label_set(functions.traverse(fields['labels']) if fields['labels'] else ())
+            namespace_info.append(Namespace(intern(fields['name']), labels))
+        return namespace_info
+
+    @cached_field
+    def connectionRecords(self):
+        """
+        Returns list of dictionaries with TLS connection details, one per target tested with openssl s_client.
+        """
+        # Process OpenSSL s_client output
         ###############################################################################################################
-                        # TODO there is no port search in here. figure out how to return open ports
-                        if 'ipBlock' == key: # CIDR selector
-                            cidr = ''
-                            less = ''
-                            for value in functions.traverse(item[key]):
-                                if 'cidr' in value:
-                                    cidr = ipaddress.IPv4Network(value[1])
-                                if 'except' in value: # CIDR minus exception
-                                    less = [ipaddress.IPv4Network(item) for item in value[1]]
-
-
-                            if less:
-                                # Remove the exception subnets from the supernet and return a set of the results.
-                                ###################################################################################
-                                resultant_cidrs = []
-                                for item in less:
-                                    resultant_cidrs.extend(list(cidr.address_exclude(item)))
-
-                                for i in set(resultant_cidrs):
-                                    selectors.append('CIDR:' + str(i))
-                                ###################################################################################
-                            else:
-                                selectors.append('CIDR:' + str(cidr))
-                        if 'namespaceSelector' == key: # namespace label selector
-                            for value in functions.traverse(item[key]):
-                                selectors.append(f"NSLABEL:{value[0]}={value[1]}")
-                        if 'podSelector' == key:
-                            for value in functions.traverse(item[key]):
-                                selectors.append(f"PODLABEL:{value[0]}={value[1]}")
-        elif isinstance(json, abc.Mapping): # Only podSelectors will be in this format and always use matchLabel
-            for key in json:
-                for value in functions.traverse(json[key]):
-                    selectors.append(f"PODLABEL:{value[0]}={value[1]}")
-    else:
-        selectors.append('*') # An empty selector selects everything.
-    return selectors
+        records = {}
+        for span in self.find_sections('openssl s_client'):
+            section = functions.read_section(self.text, span)
+            functions.process_openssl_output(self.platform, self.date, section.output, section.command, records)
+        return list(records.values())
+
+    @property
+    def connectionDetails(self):
+        """
+        Connection details of the first target, for evidence that only tests one.
+        """
+        if self.connectionRecords:
+            return self.connectionRecords[0]
+        return {'Available Ciphers': []}
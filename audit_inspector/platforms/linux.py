@@ -1,77 +1,146 @@
-import re
+from functools import cached_property
 from audit_inspector.common import functions
+from audit_inspector.common.cache import cached_field
+
+# Parsed 'sshd -T' configurations by fingerprint. Most hosts are built from a few images and have identical
+# configurations, so each configuration is only parsed once per process.
+sshd_configs = {}
+max_sshd_configs = 4096
 
 
 class linux():
-    
+    """
+    Linux evidence of one or more servers.
+
+    Sections are indexed when the object is created and parsed the first time an attribute needs them.
+    """
+
+    parser_version = 7 # Increase when parsing changes so cached results are discarded
+    platform = 'Linux'
+
     def __init__(self, text):
-        
-        # TEXT PROCESSING VARIABLES
-        ###############################################################################################################
-        section_regxp = re.compile(r'(?<=\+\s)?(?P<command>.*)\n(?P<output>[\s\S]*?)\+\s')
-        command_regx = re.search(section_regxp, text).group('command')
-        output_regx = re.search(section_regxp, text).group('output')
-        ###############################################################################################################
-
-        # EVIDENCE VARIABLES
-        ###############################################################################################################
-        connectionDetails = {}
-        date = '' # This needs to be included with any information returned by the class
-        hostname = '' # This needs to be included with any information returned by the class
-        platform = 'Linux'
-        ###############################################################################################################
-        
-        for section in re.finditer(section_regxp, text):
-            if 'hostname' in section.group('command'):
-                hostname = functions.get_hostname(section.group('output'))
-            
-            if 'date' in section.group('command'):
-                date = functions.get_evidence_date(section.group('output'))
-            
-            if ('OpenSSH_' in section.group('command')) or ('sshd -T' in section.group('command')):
-                def getConnectionDetails():
-                    """
-                    Returns list of dictionaries with authentication connection details.
-                    {<Platform>:<string>, <Hostname>:<string>, <Date>:<datetime>, <Protocol>:<string>, 
-                    <Version>:<float>, <Cipher>:<string>, <Available Ciphers>:<list>, <Credential Methods>:<list>,
-                    <Idle Timeout>:<int>, <Root Login>:<str>}
-                    """
-                    # <Platform>
-                    connectionDetails['Platform'] = platform
-                    # <Hostname>
-                    connectionDetails['Hostname'] = hostname
-                    # <Date>
-                    connectionDetails['Date'] = date
-                    # <Protocol>
-                    if 'OpenSSH_' in section.group('command'):
-                        connectionDetails['Protocol'] = 'SSH'
-                        # <Version>
-                        if 'SSH2' in section.group('output'):
-                            connectionDetails['Version'] = 2
-                        else:
-                            connectionDetails['Version'] = 1
-                        # <Cipher>
-                        if 'kex: server->client' in section.group('output'):
-                            connectionDetails['Cipher'] = re.search(r'kex: server->client cipher:\s([a-z].*)\sMAC', section.group('output')).group(1)
-                    # <Available Ciphers>
-                    if 'sshd -T' in section.group('command'):
-                        connectionDetails['Available Ciphers'] = re.search(r'ciphers\s(.*)', section.group('output')).group(1).split(',')
-                        # <Credential Methods>
-                        def get_credential_method():
-                            method = []
-                            if 'pubkeyauthentication yes' in section.group('output'):
-                                method.append('key')
-                            elif 'passwordauthentication yes' in section.group('output'):
-                                method.append('password')
-                            return method
-                        connectionDetails['Credential Methods'] = get_credential_method()
-                        # <Idle Timeout>
-                        def get_idle_timeout():
-                            interval = int(re.search(r'clientaliveinterval\s(\d+)', section.group('output')).group(1))
-                            multiplier = int(re.search(r'clientalivecountmax\s(\d+)', section.group('output')).group(1))
-                            return interval * multiplier # timeout is calculated by interval (in seconds) * count
-                        connectionDetails['Idle Timeout'] = int(get_idle_timeout())
-                        if 'permitrootlogin' in section.group('output'):
-                            connectionDetails['Root Login'] = re.search(r'permitrootlogin\s(.*)', section.group('output')).group(1)
-                getConnectionDetails()
-        self.connectionDetails = connectionDetails
\ No newline at end of file
+        self.text = text
+
+    @cached_property
+    def sections(self):
+        return functions.index_sections(self.text)
+
+    def find_sections(self, *keywords):
+        """
+        Returns:
+        Sections whose command contains any of the keywords, in the order they appear in the evidence.
+        """
+        for span in self.sections:
+            if any(keyword in span.command for keyword in keywords):
+                yield functions.read_section(self.text, span)
+
+    @cached_property
+    def hosts(self):
+        """
+        Section spans grouped by host. A file can hold the evidence of many servers one after the other, so a new
+        host starts at every 'hostname' section. Sections before the first one belong to the first host.
+        """
+        hosts = [[]]
+        named = False # Whether the current host has had its hostname section
+        for span in self.sections:
+            if 'hostname' in span.command:
+                if named:
+                    hosts.append([])
+                named = True
+            hosts[-1].append(span)
+        return hosts
+
+    @cached_field
+    def hostname(self):
+        return self.records[0]['Hostname'] if self.records else ''
+
+    @cached_field
+    def date(self):
+        return self.records[0]['Date'] if self.records else ''
+
+    @cached_field
+    def records(self):
+        """
+        Returns list of dictionaries with authentication connection details, one per host in the evidence.
+        {<Platform>:<string>, <Hostname>:<string>, <Date>:<datetime>, <Protocol>:<string>,
+        <Version>:<float>, <Cipher>:<string>, <Available Ciphers>:<list>, <MACs>:<list>, <Key Exchange>:<list>,
+        <Credential Methods>:<list>, <Idle Timeout>:<int>, <Root Login>:<str>, <Config Fingerprint>:<str>}
+        Hosts with the same 'sshd -T' configuration share one parsed configuration, see parse_sshd_section().
+        """
+        records = []
+        for spans in self.hosts:
+            hostname = date = ''
+            sshd_config = ssh_debug = fingerprint = None
+            for span in spans:
+                if 'hostname' in span.command:
+                    hostname = functions.get_hostname(functions.read_section(self.text, span).output)
+                elif 'date' in span.command:
+                    date = functions.get_evidence_date(functions.read_section(self.text, span).output)
+                elif 'sshd -T' in span.command:
+                    fingerprint, sshd_config = parse_sshd_section(functions.read_section(self.text, span).output)
+                elif 'OpenSSH_' in span.command or 'ssh -v' in span.command:
+                    ssh_debug = functions.parse_ssh_debug(functions.read_section(self.text, span).output)
+            if sshd_config is None and ssh_debug is None:
+                continue
+            records.append(connection_record(self.platform, hostname, date, sshd_config, ssh_debug, fingerprint))
+        return records
+
+    @property
+    def connectionDetails(self):
+        """
+        Connection details of the first host, for evidence of a single server.
+        """
+        return self.records[0] if self.records else {}
+
+
+def parse_sshd_section(output):
+    """
+    Parse 'sshd -T' output, or reuse the parsed configuration of an earlier host with the same configuration.
+
+    Returns:
+    Tuple of the fingerprint of the normalized configuration and the configuration from parse_sshd_config(). The
+    configuration may be shared with other hosts so it must not be modified.
+    """
+    normalized = functions.normalize_sshd_config(output)
+    fingerprint = functions.config_fingerprint(normalized)
+    config = sshd_configs.get(fingerprint)
+    if config is None:
+        if len(sshd_configs) >= max_sshd_configs:
+            sshd_configs.clear()
+        config = sshd_configs[fingerprint] = functions.parse_sshd_config(normalized)
+    return fingerprint, config
+
+
+def connection_record(platform, hostname, date, sshd_config, ssh_debug, fingerprint=None):
+    """
+    Build a connection record from the tokenized 'sshd -T' and 'ssh -v' output of one host.
+
+    Parameters:
+    fingerprint: Fingerprint of the host's 'sshd -T' configuration, for grouping hosts with the same configuration.
+    """
+    record = {'Platform': platform, 'Hostname': hostname, 'Date': date, 'Protocol': 'SSH'}
+    if ssh_debug is not None:
+        record['Version'] = ssh_debug['version']
+        if 'cipher' in ssh_debug:
+            record['Cipher'] = ssh_debug['cipher']
+    if sshd_config is not None:
+        record['Available Ciphers'] = sshd_config.get('ciphers', [])
+        record['MACs'] = sshd_config.get('macs', [])
+        record['Key Exchange'] = sshd_config.get('kexalgorithms', [])
+        # <Credential Methods>
+        if sshd_config.get('pubkeyauthentication') == 'yes':
+            record['Credential Methods'] = ['key']
+        elif sshd_config.get('passwordauthentication') == 'yes':
+            record['Credential Methods'] = ['password']
+        else:
+            record['Credential Methods'] = []
+        # <Idle Timeout>
+        interval = sshd_config.get('clientaliveinterval')
+        multiplier = sshd_config.get('clientalivecountmax')
+        if isinstance(interval, int) and isinstance(multiplier, int):
+            record['Idle Timeout'] = interval * multiplier # timeout is calculated by interval (in seconds) * count
+        if 'permitrootlogin' in sshd_config:
+            record['Root Login'] = sshd_config['permitrootlogin']
+        if fingerprint is not None:
+            record['Config Fingerprint'] = fingerprint
+    return record
@@ -0,0 +1,195 @@
+"""
+Write synthetic evidence files in the formats the platform parsers expect.
+
+Linux files hold the hostname, date, sshd -T and ssh -v sections of one or more servers. Kubernetes files hold the
+date, config view, get pods/networkpolicy/service/namespace -o json and openssl s_client sections of one cluster.
+The content is random but seeded, so the same options always write the same files.
+
+Usage:
+python -m benchmarks.generate_evidence <OUTPUT DIR> [--linux-files N] [--hosts-per-file N] [--images N]
+    [--kubernetes-files N] [--pods N] [--policies N] [--namespaces N] [--services N] [--tls-targets N] [--seed N]
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ssh_ciphers = ['chacha20-poly1305@openssh.com', 'aes128-ctr', 'aes192-ctr', 'aes256-ctr', 'aes128-gcm@openssh.com', 'aes256-gcm@openssh.com', 'arcfour', 'arcfour128', 'arcfour256', '3des-cbc']
+tls_protocols = [('-tls1', 'TLSv1'), ('-tls1_1', 'TLSv1.1'), ('-tls1_2', 'TLSv1.2'), ('-tls1_3', 'TLSv1.3')]
+tls_ciphers = ['ECDHE-RSA-AES128-GCM-SHA256', 'ECDHE-RSA-AES256-GCM-SHA384', 'AES128-SHA', 'TLS_AES_256_GCM_SHA384']
+apps = ['web', 'api', 'db', 'cache', 'queue', 'worker', 'auth', 'search']
+tiers = ['front', 'back', 'data']
+
+
+def evidence_date(rng):
+    date = datetime(2026, 1, 1) + timedelta(days=rng.randrange(365), seconds=rng.randrange(86400))
+    return date.strftime('%a %b %d %H:%M:%S UTC %Y')
+
+
+def linux_host(rng, hostname, images=0):
+    """
+    Returns:
+    Evidence text for one Linux server. With images the SSH configuration is one of that many, as for servers built
+    from a few golden images.
+    """
+    config_rng = random.Random(rng.randrange(images)) if images else rng
+    ciphers = config_rng.sample(ssh_ciphers, config_rng.randint(2, 6))
+    lines = [
+        '+ hostname', hostname,
+        '+ date', evidence_date(rng),
+        '+ sshd -T',
+        'port 22',
+        f'ciphers {",".join(ciphers)}',
+        'macs hmac-sha2-256,hmac-sha2-512',
+        'kexalgorithms curve25519-sha256,diffie-hellman-group14-sha256',
+        f'clientaliveinterval {config_rng.choice([0, 300, 600, 900])}',
+        f'clientalivecountmax {config_rng.choice([0, 1, 3])}',
+        f'permitrootlogin {config_rng.choice(["yes", "no", "without-password", "forced-commands-only"])}',
+        f'pubkeyauthentication {config_rng.choice(["yes", "no"])}',
+        f'passwordauthentication {config_rng.choice(["yes", "no"])}',
+        '+ ssh -v localhost 2>&1 | OpenSSH_',
+        'OpenSSH_8.0p1, OpenSSL 1.1.1k  FIPS 25 Mar 2021',
+        'debug1: Remote protocol version 2.0, remote software version OpenSSH_8.0',
+        f'debug1: kex: server->client cipher: {ciphers[0]} MAC: umac-64-etm@openssh.com compression: none',
+        'debug1: SSH2_MSG_SERVICE_ACCEPT received',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def linux_evidence(rng, hosts=1, prefix='host', images=0):
+    """
+    Returns:
+    Evidence text for hosts Linux servers, one after the other as a collection script run over many servers writes it.
+    """
+    return ''.join(linux_host(rng, f'{prefix}{i:05d}.example.com', images) for i in range(hosts))
+
+
+def labels(rng):
+    return {'app': rng.choice(apps), 'tier': rng.choice(tiers)}
+
+
+def kubectl_list(items):
+    return json.dumps({'apiVersion': 'v1', 'kind': 'List', 'items': items, 'metadata': {'resourceVersion': ''}}, indent=4)
+
+
+def pod(rng, i, namespaces):
+    container = {'image': f'registry.example.com/{rng.choice(apps)}:{rng.randint(1, 9)}.{rng.randint(0, 20)}', 'resources': {}}
+    if rng.random() < 0.7:
+        container['resources']['limits'] = {'cpu': f'{rng.randint(1, 4)}', 'memory': f'{rng.choice([256, 512, 1024])}Mi'}
+    return {
+        'metadata': {'name': f'pod-{i}', 'namespace': rng.choice(namespaces), 'labels': labels(rng)},
+        'spec': {'containers': [container]},
+    }
+
+
+def peer(rng):
+    kind = rng.random()
+    if kind < 0.4:
+        return {'podSelector': {'matchLabels': {'app': rng.choice(apps)}}}
+    if kind < 0.7:
+        return {'namespaceSelector': {'matchLabels': {'team': rng.choice(tiers)}}}
+    if kind < 0.85:
+        return {'podSelector': {'matchExpressions': [{'key': 'tier', 'operator': 'In', 'values': rng.sample(tiers, 2)}]}}
+    if kind < 0.95:
+        return {'ipBlock': {'cidr': f'10.{rng.randrange(256)}.0.0/16', 'except': [f'10.{rng.randrange(256)}.1.0/24']}}
+    return {'ipBlock': {'cidr': '0.0.0.0/0'}}
+
+
+def network_policy(rng, i, namespaces):
+    policy_types = rng.choice([['Ingress'], ['Egress'], ['Ingress', 'Egress']])
+    spec = {'podSelector': {'matchLabels': {'app': rng.choice(apps)}} if rng.random() < 0.9 else {}, 'policyTypes': policy_types}
+    ports = [{'protocol': 'TCP', 'port': rng.choice([80, 443, 5432, 6379, 8080])}]
+    if 'Ingress' in policy_types:
+        spec['ingress'] = [{'from': [peer(rng) for _ in range(rng.randint(1, 3))], 'ports': ports}]
+    if 'Egress' in policy_types:
+        spec['egress'] = [{'to': [peer(rng) for _ in range(rng.randint(1, 3))], 'ports': ports}]
+    return {'metadata': {'name': f'policy-{i}', 'namespace': rng.choice(namespaces)}, 'spec': spec}
+
+
+def service(rng, i, namespaces):
+    service_type = rng.choice(['ClusterIP', 'ClusterIP', 'NodePort', 'LoadBalancer'])
+    item = {
+        'metadata': {'name': f'service-{i}', 'namespace': rng.choice(namespaces)},
+        'spec': {'type': service_type, 'selector': {'app': rng.choice(apps)}, 'ports': [{'port': rng.choice([80, 443, 8080])}]},
+        'status': {'loadBalancer': {}},
+    }
+    if service_type == 'LoadBalancer':
+        item['status']['loadBalancer']['ingress'] = [{'ip': f'203.0.113.{rng.randrange(256)}'}]
+    return item
+
+
+def openssl_sections(rng, target):
+    sections = []
+    for option, protocol in tls_protocols:
+        accepted = rng.random() < 0.6
+        cipher = rng.choice(tls_ciphers) if accepted else '0000'
+        sections.append(f'+ openssl s_client -connect {target} {option}\nCONNECTED(00000003)\nSSL-Session:\n    Protocol  : {protocol}\n    Cipher    : {cipher}\n')
+    return ''.join(sections)
+
+
+def kubernetes_evidence(rng, pods=100, policies=20, namespaces=5, services=10, tls_targets=1, cluster='k8s'):
+    """
+    Returns:
+    Evidence text for one Kubernetes cluster.
+    """
+    namespace_names = [f'namespace-{i}' for i in range(namespaces)]
+    namespace_items = [{'metadata': {'name': name, 'labels': {'team': rng.choice(tiers)}}} for name in namespace_names]
+    parts = [
+        f'+ date\n{evidence_date(rng)}\n',
+        f'+ kubectl config view\nclusters:\n- cluster:\n    server: https://{cluster}.example.com:6443\n',
+        '+ kubectl get pods -A -o json\n' + kubectl_list([pod(rng, i, namespace_names) for i in range(pods)]) + '\n',
+        '+ kubectl get networkpolicy -A -o json\n' + kubectl_list([network_policy(rng, i, namespace_names) for i in range(policies)]) + '\n',
+        '+ kubectl get service -A -o json\n' + kubectl_list([service(rng, i, namespace_names) for i in range(services)]) + '\n',
+        '+ kubectl get namespace -o json\n' + kubectl_list(namespace_items) + '\n',
+    ]
+    parts.extend(openssl_sections(rng, f'{cluster}-{i}.example.com:443') for i in range(tls_targets))
+    return ''.join(parts)
+
+
+def generate(output_dir, linux_files=10, hosts_per_file=1, images=0, kubernetes_files=2, pods=100, policies=20, namespaces=5, services=10, tls_targets=1, seed=0):
+    """
+    Write a synthetic evidence directory.
+
+    Returns:
+    List of the paths written.
+    """
+    rng = random.Random(seed)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(linux_files):
+        path = output_dir / f'linux-{i:05d}.txt'
+        path.write_text(linux_evidence(rng, hosts_per_file, prefix=f'host{i:05d}-', images=images), encoding='utf8')
+        paths.append(path)
+    for i in range(kubernetes_files):
+        path = output_dir / f'kubernetes-{i:05d}.txt'
+        path.write_text(kubernetes_evidence(rng, pods, policies, namespaces, services, tls_targets, cluster=f'cluster{i}'), encoding='utf8')
+        paths.append(path)
+    return paths
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(prog='generate_evidence', description='Write synthetic evidence files for benchmarking.')
+    parser.add_argument('output_dir', help='Directory the evidence files are written to.')
+    parser.add_argument('--linux-files', type=int, default=10, help='Number of Linux evidence files.')
+    parser.add_argument('--hosts-per-file', type=int, default=1, help='Number of servers in each Linux evidence file.')
+    parser.add_argument('--images', type=int, default=0, help='Number of distinct Linux SSH configurations, 0 for a random one per server.')
+    parser.add_argument('--kubernetes-files', type=int, default=2, help='Number of Kubernetes evidence files.')
+    parser.add_argument('--pods', type=int, default=100, help='Pods per Kubernetes file.')
+    parser.add_argument('--policies', type=int, default=20, help='Network policies per Kubernetes file.')
+    parser.add_argument('--namespaces', type=int, default=5, help='Namespaces per Kubernetes file.')
+    parser.add_argument('--services', type=int, default=10, help='Services per Kubernetes file.')
+    parser.add_argument('--tls-targets', type=int, default=1, help='Targets tested with openssl s_client per Kubernetes file.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = vars(parse_arguments(argv))
+    paths = generate(args.pop('output_dir'), **args)
+    print(f'Wrote {len(paths)} evidence files, {sum(path.stat().st_size for path in paths) / 1024 / 1024:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""
+Measure the throughput and peak memory of each processing stage.
+
+The stages are the steps every evidence file goes through, which is read from its path or archive member the way
+process_file() reads it:
+read       the file is read once, decompressing archive members
+tokenize   index_sections() finds its sections
+dispatch   the control registry finds the controls that apply
+parse      the platform classes parse every field the controls use
+check      the controls run their checks on the parsed fields, including their finalize steps
+
+Each stage is timed on its own with the best of --repeat runs, then the run is repeated under tracemalloc to find
+the peak memory each stage allocates. Results can be saved and compared against a saved baseline, which makes the
+run exit with status 1 when a stage got slower than the tolerance allows.
+
+Usage:
+python -m benchmarks.run_benchmarks [EVIDENCE DIR] [--repeat N] [--no-memory] [--save FILE] [--baseline FILE]
+    [--tolerance FRACTION]
+
+Without an evidence directory a synthetic one is written with benchmarks.generate_evidence.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from audit_inspector.__main__ import list_evidence_files
+from audit_inspector.common import cache, dispatch, evidence, functions
+from audit_inspector.common.results import ResultSet
+from audit_inspector.platforms import kubernetes as kube
+from audit_inspector.platforms import linux as lnx
+from benchmarks import generate_evidence
+
+stages = ['read', 'tokenize', 'dispatch', 'parse', 'check']
+# Platform class and the fields its controls use, by the platform name used in the control registry
+platform_fields = {
+    'kubernetes': (kube.kubernetes, ['date', 'hostname', 'pods', 'firewall', 'services', 'namespaces', 'connectionRecords']),
+    'linux': (lnx.linux, ['records']),
+}
+
+
+class StageTimer():
+    """
+    Accumulates the time, and optionally the peak traced memory, spent in each stage.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.seconds = dict.fromkeys(stages, 0.0)
+        self.peak_bytes = dict.fromkeys(stages, 0)
+
+    def run(self, stage, function, *args):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        result = function(*args)
+        self.seconds[stage] += time.perf_counter() - start
+        if self.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            self.peak_bytes[stage] = max(self.peak_bytes[stage], peak - baseline)
+        return result
+
+
+def read_source(source):
+    """
+    Returns:
+    Bytes in the evidence. An archive member stays open and decompressed for the following stages, as in a normal run.
+    """
+    size = 0
+    with evidence.open_evidence(source) as f:
+        for data in iter(lambda: f.read(evidence.block_size), b''):
+            size += len(data)
+    return size
+
+
+def parse_fields(entries, source):
+    for platform in {entry['platform'] for entry in entries}:
+        if platform in platform_fields:
+            cls, fields = platform_fields[platform]
+            platform_object = cache.parse(cls, source)
+            for field in fields:
+                getattr(platform_object, field)
+
+
+def run_checks(entries, source):
+    """
+    Run the controls through the registry, which calls each control once and skips those not implemented yet.
+    """
+    registry = dispatch.get_registry()
+    results = ResultSet(registry.finalizer)
+    results.extend(registry.dispatch(source, entries))
+    results.finalize() # Controls like connection check their records here
+    return results
+
+
+def run_once(paths, trace_memory=False):
+    """
+    Process every file once, timing each stage.
+
+    Parsed objects are kept between the parse and check stages through cache.parse(), as in a normal run, so the
+    check stage measures only the checks.
+
+    Returns:
+    StageTimer
+    """
+    timer = StageTimer(trace_memory)
+    registry = dispatch.get_registry()
+    for path in (source for path in paths for source in evidence.iter_evidence(path)):
+        try:
+            timer.run('read', read_source, path)
+            timer.run('tokenize', functions.index_sections, path)
+            entries = timer.run('dispatch', registry.match, path)
+            timer.run('parse', parse_fields, entries, path)
+            timer.run('check', run_checks, entries, path)
+        finally:
+            cache.forget()
+            if isinstance(path, evidence.Evidence):
+                path.close()
+    return timer
+
+
+def size_on_disk(paths):
+    """
+    Returns:
+    Bytes of the files the evidence is read from, counting an archive once however many members it has.
+    """
+    return sum(Path(path).stat().st_size for path in {getattr(path, 'path', path) for path in paths})
+
+
+def benchmark(paths, repeat=3, trace_memory=True):
+    """
+    Returns:
+    {<stage>: {'seconds', 'mb_per_second', 'files_per_second', 'peak_mb'}}
+    """
+    total_bytes = size_on_disk(paths)
+    best = dict.fromkeys(stages, float('inf'))
+    for _ in range(repeat):
+        timer = run_once(paths)
+        for stage in stages:
+            best[stage] = min(best[stage], timer.seconds[stage])
+    peak_bytes = dict.fromkeys(stages)
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            peak_bytes = run_once(paths, trace_memory=True).peak_bytes
+        finally:
+            tracemalloc.stop()
+    report = {}
+    for stage in stages:
+        seconds = best[stage]
+        report[stage] = {
+            'seconds': seconds,
+            'mb_per_second': total_bytes / 1024 / 1024 / seconds if seconds else None,
+            'files_per_second': len(paths) / seconds if seconds else None,
+            'peak_mb': peak_bytes[stage] / 1024 / 1024 if peak_bytes[stage] is not None else None,
+        }
+    return report
+
+
+def regressions(report, baseline, tolerance):
+    """
+    Returns:
+    List of descriptions of the stages that are slower than the baseline by more than tolerance.
+    """
+    slower = []
+    for stage in stages:
+        if stage not in baseline.get('stages', {}):
+            continue
+        before = baseline['stages'][stage]['seconds']
+        after = report[stage]['seconds']
+        if before and after > before * (1 + tolerance):
+            slower.append(f'{stage}: {before:.3f}s -> {after:.3f}s ({after / before - 1:+.0%})')
+    return slower
+
+
+def format_report(report, files, total_bytes):
+    def number(value, spec):
+        return format(value, spec) if value is not None else format('-', '>10')
+
+    lines = [f'{files} files, {total_bytes / 1024 / 1024:.1f} MB', f'{"stage":<10}{"seconds":>10}{"MB/s":>10}{"files/s":>10}{"peak MB":>10}']
+    for stage in stages:
+        row = report[stage]
+        lines.append(f'{stage:<10}{row["seconds"]:>10.3f}{number(row["mb_per_second"], ">10.1f")}{number(row["files_per_second"], ">10.1f")}{number(row["peak_mb"], ">10.1f")}')
+    return '\n'.join(lines)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(prog='run_benchmarks', description='Measure the throughput and peak memory of each processing stage.')
+    parser.add_argument('evidence_dir', nargs='?', help='Directory of evidence files. A synthetic set is generated when omitted.')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs, the best is reported.')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc run.')
+    parser.add_argument('--save', help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', help='JSON file written by --save to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown against the baseline, as a fraction.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    with tempfile.TemporaryDirectory() as generated:
+        if args.evidence_dir:
+            paths = list_evidence_files(Path(args.evidence_dir))
+        else:
+            paths = generate_evidence.generate(generated, linux_files=200, hosts_per_file=5, kubernetes_files=4, pods=2000, policies=200, namespaces=20, services=100, tls_targets=5)
+        total_bytes = size_on_disk(paths)
+        report = benchmark(paths, repeat=args.repeat, trace_memory=not args.no_memory)
+    print(format_report(report, len(paths), total_bytes))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'files': len(paths), 'bytes': total_bytes, 'stages': report}, f, indent=4)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(report, json.load(f), args.tolerance)
+        for line in slower:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
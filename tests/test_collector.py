@@ -0,0 +1,75 @@
+import asyncio
+import json
+import os
+import time
+import pytest
+from audit_inspector.common import collector
+
+pytestmark = pytest.mark.skipif(os.name != 'posix', reason='stub commands are shell scripts')
+
+stubs = {
+    # ssh <host> <command>: answers like the audited host would. sshd -T is the slowest so it finishes last.
+    'ssh': '''#!/bin/sh
+host=$1; shift
+case "$*" in
+  hostname) echo "$host";;
+  date) sleep 0.2; echo "Mon Oct 12 10:00:00 UTC 2026";;
+  "sshd -T") sleep 0.4; printf 'ciphers aes128-ctr,arcfour\\npermitrootlogin no';;
+  *) echo "unknown command" >&2; exit 1;;
+esac
+''',
+    # hang <pid file>: starts a child that outlives the shell unless the whole process group is killed
+    'hang': '''#!/bin/sh
+sleep 30 &
+echo $! > "$1"
+wait
+''',
+}
+
+
+def collect(tmp_path, commands, targets, timeout=10):
+    stub_dir = tmp_path / 'stubs'
+    stub_dir.mkdir()
+    for name, script in stubs.items():
+        (stub_dir / name).write_text(script)
+        (stub_dir / name).chmod(0o755)
+    manifest_path = tmp_path / 'manifest.json'
+    manifest_path.write_text(json.dumps({'timeout': timeout, 'path': ['stubs'], 'commands': {'linux': commands}, 'targets': targets}))
+    processed = []
+    log, _ = asyncio.run(collector.collect(collector.load_manifest(manifest_path), tmp_path / 'out', processed.append))
+    return log, processed
+
+
+def running(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z' # A zombie has exited
+    except FileNotFoundError:
+        return False
+
+
+def test_sections_are_labelled_in_manifest_order(tmp_path):
+    commands = [
+        {'label': 'hostname', 'command': 'ssh {host} hostname'},
+        'ssh {host} date', # Labelled with the command before the host is filled in
+        {'label': 'sshd -T', 'command': 'ssh {host} sshd -T'},
+    ]
+    log, processed = collect(tmp_path, commands, [{'name': 'update01', 'platform': 'linux', 'vars': {'host': 'update01.example'}}])
+    evidence = tmp_path / 'out' / 'update01.txt'
+    assert processed == [evidence]
+    assert evidence.read_text() == (
+        '+ hostname\nupdate01.example\n'
+        '+ ssh {host} date\nMon Oct 12 10:00:00 UTC 2026\n'
+        '+ sshd -T\nciphers aes128-ctr,arcfour\npermitrootlogin no\n'
+    )
+    assert [run['status'] for run in log['update01']['commands']] == [0, 0, 0]
+    assert sorted(path.name for path in evidence.parent.iterdir()) == ['collection.json', 'update01.txt'] # No part files left
+
+
+def test_timeout_kills_the_process_group(tmp_path):
+    pid_file = tmp_path / 'child.pid'
+    started = time.perf_counter()
+    log, _ = collect(tmp_path, [{'label': 'hang', 'command': f'hang {pid_file}'}], [{'name': 'web01', 'platform': 'linux'}], timeout=1)
+    assert time.perf_counter() - started < 10
+    assert log['web01']['commands'][0]['status'] is None
+    assert not running(int(pid_file.read_text()))
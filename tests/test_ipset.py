@@ -0,0 +1,71 @@
+import ipaddress
+from audit_inspector.common import ipset
+from audit_inspector.common.ipset import IPSet, intersect_ranges, merge_ranges, subtract_ranges
+
+
+def test_merge_joins_adjacent_ranges():
+    assert merge_ranges([(0, 9), (10, 19), (25, 30)]) == [(0, 19), (25, 30)]
+    assert IPSet(['10.0.0.0/25', '10.0.0.128/25']).cidrs() == [ipaddress.ip_network('10.0.0.0/24')]
+
+
+def test_subtract_from_the_middle():
+    assert subtract_ranges([(0, 99)], [(10, 19), (50, 59)]) == [(0, 9), (20, 49), (60, 99)]
+
+
+def test_subtract_adjacent_ranges():
+    assert subtract_ranges([(10, 19)], [(0, 9), (20, 29)]) == [(10, 19)]
+    assert subtract_ranges([(0, 9), (10, 19)], [(10, 19)]) == [(0, 9)]
+
+
+def test_subtract_covering_and_edges():
+    assert subtract_ranges([(10, 19)], [(0, 99)]) == []
+    assert subtract_ranges([(10, 19)], [(10, 10), (19, 19)]) == [(11, 18)]
+    assert subtract_ranges([(0, 9), (20, 29)], [(5, 24)]) == [(0, 4), (25, 29)]
+
+
+def test_intersect():
+    assert intersect_ranges([(0, 9), (20, 29)], [(5, 24)]) == [(5, 9), (20, 24)]
+    assert intersect_ranges([(0, 9)], [(10, 19)]) == []
+    assert intersect_ranges([(0, 9)], [(9, 19)]) == [(9, 9)]
+
+
+def test_exception_outside_the_block_is_ignored():
+    assert ipset.ip_block('10.0.0.0/24', ['192.168.0.0/16']) == IPSet(['10.0.0.0/24'])
+
+
+def test_exception_inside_the_block():
+    block = ipset.ip_block('10.0.0.0/24', ['10.0.0.128/25'])
+    assert '10.0.0.1' in block
+    assert '10.0.0.200' not in block
+    assert '10.0.0.0/25' in block
+    assert '10.0.0.0/24' not in block
+
+
+def test_mixed_ipv4_and_ipv6():
+    mixed = IPSet(['10.0.0.0/8', '2001:db8::/32'])
+    assert '10.1.2.3' in mixed
+    assert '2001:db8::1' in mixed
+    assert '2001:db9::1' not in mixed
+    assert '::ffff:10.1.2.3' not in mixed # IPv4 mapped addresses are IPv6, not the IPv4 address
+    assert mixed - IPSet(['10.0.0.0/8']) == IPSet(['2001:db8::/32'])
+    assert mixed & IPSet(['::/0']) == IPSet(['2001:db8::/32'])
+    assert mixed.cidrs() == [ipaddress.ip_network('10.0.0.0/8'), ipaddress.ip_network('2001:db8::/32')]
+
+
+def test_contains_at_range_boundaries():
+    ranges = IPSet(['10.0.0.0/24', '10.0.2.0/24'])
+    assert '10.0.0.255' in ranges
+    assert '10.0.1.0' not in ranges
+    assert '10.0.2.0' in ranges
+    assert '9.255.255.255' not in ranges
+    assert '10.0.0.0/23' not in ranges
+    assert '10.0.0.0' not in IPSet()
+
+
+def test_internet():
+    assert '8.8.8.8' in ipset.internet
+    assert '10.1.2.3' not in ipset.internet
+    assert '2606:4700::1111' in ipset.internet6
+    assert 'fd00::1' not in ipset.internet6
+    assert 'fe80::1' not in ipset.internet6
+    assert not ipset.internet6 - IPSet(['::/0'])
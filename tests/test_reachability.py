@@ -0,0 +1,79 @@
+from audit_inspector.common import reachability
+from audit_inspector.controls import firewall
+from audit_inspector.platforms.kubernetes import Namespace, NetworkPolicy, Pod, Records
+
+
+def records(cls, *items):
+    """
+    Returns:
+    Records of cls from (name, namespace or None, {<label>: <value>}) tuples.
+    """
+    result = Records()
+    for name, namespace, labels in items:
+        labels = result.labels.label_set(labels.items())
+        if cls is Namespace:
+            result.append(Namespace(name, labels))
+        else:
+            result.append(Pod(name, namespace, labels, 'nginx', None))
+    return result
+
+
+def policy(name, namespace, selector, direction, rules):
+    return NetworkPolicy(name, namespace, direction, selector, rules)
+
+
+def engine(*policies):
+    pods = records(Pod, ('web', 'shop', {'app': 'web'}), ('db', 'shop', {'app': 'db'}), ('job', 'batch', {'app': 'job'}))
+    namespaces = records(Namespace, ('shop', None, {'team': 'shop'}), ('batch', None, {'team': 'data'}))
+    return reachability.NetworkPolicyEngine(pods, policies, namespaces)
+
+
+def test_pods_without_policies_are_not_isolated():
+    e = engine()
+    assert not e.is_isolated(0, 'ingress')
+    assert e.allows(2, 1)
+    assert e.describe(0, 'ingress') == ['*']
+
+
+def test_pod_selector_peer():
+    e = engine(policy('db-from-web', 'shop', {'matchLabels': {'app': 'db'}}, 'ingress',
+                      [{'from': [{'podSelector': {'matchLabels': {'app': 'web'}}}], 'ports': [{'port': 5432}]}]))
+    assert e.is_isolated(1, 'ingress')
+    assert not e.is_isolated(0, 'ingress')
+    assert e.allows(0, 1)
+    assert not e.allows(2, 1) # Pod selectors only select pods in the policy's namespace
+
+
+def test_namespace_selector_peer():
+    e = engine(policy('db-from-data', 'shop', {'matchLabels': {'app': 'db'}}, 'ingress',
+                      [{'from': [{'namespaceSelector': {'matchLabels': {'team': 'data'}}}]}]))
+    assert e.allows(2, 1)
+    assert not e.allows(0, 1)
+
+
+def test_policy_without_rules_denies_everything():
+    e = engine(policy('deny', 'shop', {}, 'ingress', []))
+    assert e.is_isolated(0, 'ingress') and e.is_isolated(1, 'ingress')
+    assert not e.allows(1, 0)
+    assert not e.allowed_addresses(0, 'ingress')
+
+
+def test_exposed_pods_by_port():
+    e = engine(policy('web-public', 'shop', {'matchLabels': {'app': 'web'}}, 'ingress',
+                      [{'from': [{'ipBlock': {'cidr': '0.0.0.0/0', 'except': ['10.0.0.0/8']}}], 'ports': [{'port': 443}]}]))
+    assert e.exposed_pods('8.8.8.0/24', port=443) == [0, 1, 2] # db and job aren't isolated so everything reaches them
+    assert e.exposed_pods('8.8.8.0/24', port=80) == [1, 2]
+    assert e.exposed_pods('10.1.0.0/16', port=443) == [1, 2]
+
+
+def unrestricted_ingress(cidr):
+    e = engine(policy('web-public', 'shop', {'matchLabels': {'app': 'web'}}, 'ingress', [{'from': [{'ipBlock': {'cidr': cidr}}]}]))
+    return firewall.check_unrestricted_ingress(e, 0, {'Interface': 'web', 'Namespace': 'shop'})
+
+
+def test_unrestricted_ingress():
+    assert unrestricted_ingress('0.0.0.0/0')
+    assert unrestricted_ingress('::/0')
+    assert unrestricted_ingress('2000::/3')
+    assert not unrestricted_ingress('203.0.113.0/24')
+    assert not unrestricted_ingress('fd00::/8')